@@ -2,19 +2,19 @@ import io
 import cv2
 import time
 import math
-import ctypes
 import multiprocessing
 import numpy as np
 import tensorflow as tf
 import matplotlib.pyplot as plt
 from PIL import Image
-from multiprocessing import Pool
 from mpl_toolkits.mplot3d import Axes3D
 
 from NN.Basic.Optimizers import OptFactory
 
 from Util.Util import VisUtil
 from Util.Timing import Timing
+from Util.Kernel import Kernel, KernelCache, KernelApproximation, as_matrix, issparse
+from Util.Parallel import WorkerPool
 from Util.ProgressBar import ProgressBar
 
 try:
@@ -219,7 +219,7 @@ class ClassifierBase(ModelBase):
         Base for classifiers
         Static methods:
             1) acc, f1_score           : Metrics
-            2) _multi_clf, _multi_data : Parallelization
+            2) _multi_clf, _multi_data : Parallelization (through the persistent Util.Parallel.WorkerPool)
     """
 
     clf_timing = Timing()
@@ -250,65 +250,38 @@ class ClassifierBase(ModelBase):
 
     # Parallelization
 
+    @staticmethod
+    def _get_worker_pool(kwargs):
+        pool = kwargs.get("pool")
+        if pool is not None:
+            return pool
+        n_cores = kwargs.get("n_cores", 2)
+        return WorkerPool.get(multiprocessing.cpu_count() if n_cores <= 0 else n_cores)
+
     # noinspection PyUnusedLocal
     @staticmethod
     def _multi_clf(x, clfs, task, kwargs, stack=np.vstack, target="single"):
         if target != "parallel":
-            return np.array([clf.predict(x) for clf in clfs], dtype=np.float32).T
-        n_cores = kwargs.get("n_cores", 2)
-        n_cores = multiprocessing.cpu_count() if n_cores <= 0 else n_cores
-        if n_cores == 1:
-            matrix = np.array([clf.predict(x, n_cores=1) for clf in clfs], dtype=np.float32).T
-        else:
-            pool = Pool(processes=n_cores)
-            batch_size = int(len(clfs) / n_cores)
-            clfs = [clfs[i*batch_size:(i+1)*batch_size] for i in range(n_cores)]
-            x_size = np.prod(x.shape)  # type: int
-            shared_base = multiprocessing.Array(ctypes.c_float, int(x_size))
-            shared_matrix = np.ctypeslib.as_array(shared_base.get_obj()).reshape(x.shape)
-            shared_matrix[:] = x
-            matrix = stack(
-                pool.map(task, ((shared_matrix, clfs, n_cores) for clfs in clfs))
-            ).T.astype(np.float32)
-        return matrix
+            return np.array([clf.predict(x) for clf in clfs]).T
+        pool = ClassifierBase._get_worker_pool(kwargs)
+        if pool.n_cores == 1:
+            return np.array([clf.predict(x, n_cores=1) for clf in clfs]).T
+        return stack(pool.map_clfs(x, task, clfs)).T
 
     # noinspection PyUnusedLocal
     def _multi_data(self, x, task, kwargs, stack=np.hstack, target="single"):
         if target != "parallel":
             return task((x, self, 1))
-        n_cores = kwargs.get("n_cores", 2)
-        n_cores = multiprocessing.cpu_count() if n_cores <= 0 else n_cores
-        if n_cores == 1:
-            matrix = task((x, self, n_cores))
-        else:
-            pool = Pool(processes=n_cores)
-            batch_size = int(len(x) / n_cores)
-            batch_base, batch_data, cursor = [], [], 0
-            x_dim = x.shape[1]
-            for i in range(n_cores):
-                if i == n_cores - 1:
-                    batch_data.append(x[cursor:])
-                    batch_base.append(multiprocessing.Array(ctypes.c_float, (len(x) - cursor) * x_dim))
-                else:
-                    batch_data.append(x[cursor:cursor + batch_size])
-                    batch_base.append(multiprocessing.Array(ctypes.c_float, batch_size * x_dim))
-                cursor += batch_size
-            shared_arrays = [
-                np.ctypeslib.as_array(shared_base.get_obj()).reshape(-1, x_dim)
-                for shared_base in batch_base
-            ]
-            for i, data in enumerate(batch_data):
-                shared_arrays[i][:] = data
-            matrix = stack(
-                pool.map(task, ((x, self, n_cores) for x in shared_arrays))
-            )
-        return matrix.astype(np.float32)
+        pool = ClassifierBase._get_worker_pool(kwargs)
+        if pool.n_cores == 1:
+            return task((x, self, 1))
+        return stack(pool.map_data(x, task, self))
 
     # Training
 
     @staticmethod
     def _get_train_repeat(x, batch_size):
-        train_len = len(x)
+        train_len = x.shape[0]
         batch_size = min(batch_size, train_len)
         do_random_batch = train_len > batch_size
         return 1 if not do_random_batch else int(train_len / batch_size) + 1
@@ -634,6 +607,7 @@ class GDBase(ClassifierBase):
             2) Calculate all gradients of the parameters and store them in self._grads
               in self._get_grads() method
         See self._update_model_params() method for more insights
+        x may be a scipy.sparse CSR matrix: batches are sliced by rows, and x_batch stays sparse
     """
 
     GDBaseTiming = Timing()
@@ -656,7 +630,7 @@ class GDBase(ClassifierBase):
         epoch_loss = 0
         for i in range(train_repeat):
             if train_repeat != 1:
-                batch = np.random.permutation(len(x))[:batch_size]
+                batch = np.random.permutation(x.shape[0])[:batch_size]
                 x_batch, y_batch = x[batch], y[batch]
                 sample_weight_batch = sample_weight[batch]
             else:
@@ -777,7 +751,19 @@ else:
 
 
 class KernelBase(ClassifierBase):
-    """ Kernel classifier with SMO-like algorithm """
+    """
+        Kernel classifier with SMO-like algorithm
+        Kernel matrices are computed by Util.Kernel.Kernel, block by block (block_size rows at a time, or as
+          many rows as fit in memory_budget bytes), so predictions never build the full test kernel matrix
+        Solvers which only need a few Gram rows per step (self._cache_gram = True) get a KernelCache of
+          cache_size bytes as self._gram instead of the full Gram matrix (or the one passed to fit as gram,
+          e.g. a cache shared by several sub-problems)
+        After fit, the model is compacted to its support vectors (samples with nonzero coefficients) and
+          their squared norms, so predictions only evaluate K(x, support vectors)
+        With approximation="rff" or "nystroem", inputs are mapped into an explicit n_components-dimensional
+          feature space (Util.Kernel.KernelApproximation) and a LinearSVM is trained on it instead, so that
+          training & prediction are linear in the number of samples
+    """
 
     KernelBaseTiming = Timing()
 
@@ -785,11 +771,14 @@ class KernelBase(ClassifierBase):
         super(KernelBase, self).__init__(**kwargs)
         self._do_log = True
         self._is_torch = False
+        self._cache_gram = False
         self._fit_args, self._fit_args_names = None, []
         self._x = self._y = self._gram = None
         self._w = self._b = self._alpha = None
         self._kernel = self._kernel_name = self._kernel_param = None
         self._prediction_cache = self._dw_cache = self._db_cache = None
+        self._support = self._sv_x = self._sv_coef = self._sv_norms = None
+        self._approximation = self._linear = None
 
         self._params["kernel"] = kwargs.get("kernel", "rbf")
         self._params["epoch"] = kwargs.get("epoch", 10 ** 4)
@@ -799,6 +788,11 @@ class KernelBase(ClassifierBase):
         self._params["c"] = kwargs.get("c", 1)
         self._params["p"] = kwargs.get("p", 3)
         self._params["lr"] = kwargs.get("lr", 0.001)
+        self._params["block_size"] = kwargs.get("block_size", None)
+        self._params["memory_budget"] = kwargs.get("memory_budget", 2 ** 27)
+        self._params["cache_size"] = kwargs.get("cache_size", 2 ** 28)
+        self._params["approximation"] = kwargs.get("approximation", None)
+        self._params["n_components"] = kwargs.get("n_components", 100)
 
     @property
     def title(self):
@@ -809,15 +803,28 @@ class KernelBase(ClassifierBase):
     @staticmethod
     @KernelBaseTiming.timeit(level=1, prefix="[Kernel] ")
     def _poly(x, y, p):
-        return (x.dot(y.T) + 1) ** p
+        return Kernel("poly", p=p)(x, y)
 
     @staticmethod
     @KernelBaseTiming.timeit(level=1, prefix="[Kernel] ")
     def _rbf(x, y, gamma):
-        return np.exp(-gamma * np.sum((x[..., None, :] - y) ** 2, axis=2))
+        return Kernel("rbf", gamma=gamma)(x, y)
 
     # Training
 
+    def _support_coef(self):
+        return self._w
+
+    def _compact(self):
+        coef = self._support_coef()
+        if not isinstance(coef, np.ndarray) or not (isinstance(self._x, np.ndarray) or issparse(self._x)):
+            return
+        coef = coef.ravel()
+        self._support = np.flatnonzero(coef)
+        self._sv_x = self._x[self._support]
+        self._sv_coef = coef[self._support]
+        self._sv_norms = Kernel.sq_norms(self._sv_x) if self._kernel.name == "rbf" else None
+
     def _update_dw_cache(self, *args):
         pass
 
@@ -826,23 +833,66 @@ class KernelBase(ClassifierBase):
 
     @KernelBaseTiming.timeit(level=1, prefix="[Core] ")
     def _update_pred_cache(self, *args):
+        """
+            Rank-k update of self._prediction_cache (= K.w + b) after w[args] changed by self._dw_cache and
+              b by self._db_cache: only the Gram rows of nonzero changes are read, so each step is O(n * k)
+        """
         self._prediction_cache += self._db_cache
-        if len(args) == 1:
-            self._prediction_cache += self._dw_cache * self._gram[args[0]]
-        elif len(args) == len(self._gram):
-            self._prediction_cache = self._dw_cache.dot(self._gram)
+        indices = np.asarray(args, dtype=np.int64).ravel()
+        dw = np.broadcast_to(np.asarray(self._dw_cache, dtype=np.float64).ravel(), indices.shape)
+        mask = dw != 0
+        if not np.any(mask):
+            return
+        indices, dw = indices[mask], dw[mask]
+        if len(indices) == 1:
+            self._prediction_cache += dw[0] * self._gram[int(indices[0])]
         else:
-            self._prediction_cache += self._dw_cache.dot(self._gram[args, ...])
+            self._prediction_cache += dw.dot(self._gram[indices])
 
     def _prepare(self, sample_weight, **kwargs):
         pass
 
+    def _sync_prediction_cache(self):
+        """ Bring every entry of self._prediction_cache up to date (solvers may only maintain a subset of it) """
+        pass
+
     def _torch_transform(self, y_cv):
         pass
 
     def _fit(self, *args):
         pass
 
+    def _fit_approximation(self, sample_weight, epoch, **kwargs):
+        # e_SVM.LinearSVM depends on this module, so it can only be imported here
+        from e_SVM.LinearSVM import LinearSVM
+        self._approximation = KernelApproximation(
+            self._kernel, kwargs.get("approximation", self._params["approximation"]),
+            kwargs.get("n_components", self._params["n_components"])
+        )
+        self._linear = LinearSVM(
+            c=kwargs.get("c", self._params["c"]), lr=kwargs.get("lr", self._params["lr"]), epoch=epoch)
+        self._linear.fit(self._approximation.fit_transform(self._x), self._y, sample_weight)
+        return []
+
+    def _init_kernel(self, x, kernel=None, **kwargs):
+        if kernel is None:
+            kernel = self._params["kernel"]
+        block_size = kwargs.get("block_size", self._params["block_size"])
+        memory_budget = kwargs.get("memory_budget", self._params["memory_budget"])
+        if kernel == "poly":
+            _p = kwargs.get("p", self._params["p"])
+            self._kernel_name = "Polynomial"
+            self._kernel_param = "degree = {}".format(_p)
+            self._kernel = Kernel("poly", p=_p, block_size=block_size, memory_budget=memory_budget)
+        elif kernel == "rbf":
+            _gamma = kwargs.get("gamma", 1 / x.shape[1])
+            self._kernel_name = "RBF"
+            self._kernel_param = r"$\gamma = {:8.6}$".format(_gamma)
+            self._kernel = Kernel("rbf", gamma=_gamma, block_size=block_size, memory_budget=memory_budget)
+        else:
+            raise NotImplementedError("Kernel '{}' has not defined".format(kernel))
+        return self._kernel
+
     @KernelBaseTiming.timeit(level=1, prefix="[API] ")
     def fit(self, x, y, sample_weight=None, kernel=None, epoch=None,
             x_test=None, y_test=None, metrics=None, animation_params=None, **kwargs):
@@ -859,27 +909,25 @@ class KernelBase(ClassifierBase):
         if metrics is None:
             metrics = self._params["metrics"]  # type: list
         *animation_properties, animation_params = self._get_animation_params(animation_params)
-        self._x, self._y = np.atleast_2d(x), np.asarray(y)
-        if kernel == "poly":
-            _p = kwargs.get("p", self._params["p"])
-            self._kernel_name = "Polynomial"
-            self._kernel_param = "degree = {}".format(_p)
-            self._kernel = lambda _x, _y: KernelBase._poly(_x, _y, _p)
-        elif kernel == "rbf":
-            _gamma = kwargs.get("gamma", 1 / self._x.shape[1])
-            self._kernel_name = "RBF"
-            self._kernel_param = r"$\gamma = {:8.6}$".format(_gamma)
-            self._kernel = lambda _x, _y: KernelBase._rbf(_x, _y, _gamma)
-        else:
-            raise NotImplementedError("Kernel '{}' has not defined".format(kernel))
+        self._x, self._y = as_matrix(x), np.asarray(y)
+        self._init_kernel(self._x, kernel, **kwargs)
+        self._support = self._sv_x = self._sv_coef = self._sv_norms = None
+        self._approximation = self._linear = None
+        if kwargs.get("approximation", self._params["approximation"]) is not None:
+            return self._fit_approximation(sample_weight, epoch, **kwargs)
         if sample_weight is None:
             sample_weight = np.ones(len(y))
         else:
             sample_weight = np.asarray(sample_weight) * len(y)
 
         self._alpha, self._w, self._prediction_cache = (
-            np.zeros(len(x)), np.zeros(len(x)), np.zeros(len(x)))
-        self._gram = self._kernel(self._x, self._x)
+            np.zeros(len(y)), np.zeros(len(y)), np.zeros(len(y)))
+        if self._cache_gram and kwargs.get("gram") is not None:
+            self._gram = kwargs["gram"]
+        elif self._cache_gram:
+            self._gram = KernelCache(self._kernel, self._x, kwargs.get("cache_size", self._params["cache_size"]))
+        else:
+            self._gram = self._kernel(self._x, self._x)
         self._b = 0
         self._prepare(sample_weight, **kwargs)
 
@@ -893,7 +941,7 @@ class KernelBase(ClassifierBase):
                 self.get_metrics(metrics)
             test_gram = None
             if x_test is not None and y_test is not None:
-                x_cv, y_cv = np.atleast_2d(x_test), np.asarray(y_test)
+                x_cv, y_cv = as_matrix(x_test), np.asarray(y_test)
                 test_gram = self._kernel(self._x, x_cv)
             else:
                 x_cv, y_cv = self._x, self._y
@@ -916,6 +964,7 @@ class KernelBase(ClassifierBase):
                             local_y = self._y.data.numpy()
                         else:
                             local_y = self._y
+                        self._sync_prediction_cache()
                         local_logs.append(metric(local_y, np.sign(self._prediction_cache)))
                     else:
                         if self._is_torch:
@@ -927,22 +976,44 @@ class KernelBase(ClassifierBase):
             self._handle_animation(i, self._x, self._y, ims, animation_params, *animation_properties)
             bar.update()
         self._handle_mp4(ims, animation_properties)
+        self._sync_prediction_cache()
+        self._compact()
         return logs
 
     # Util
 
+    def _kernel_dot(self, x, coef):
+        x = as_matrix(x)
+        if self._sv_x is None:
+            return self._kernel.dot(x, self._x, coef)
+        return self._kernel.dot(x, self._sv_x, self._sv_coef, y_norms=self._sv_norms)
+
+    @property
+    def n_support(self):
+        return None if self._support is None else len(self._support)
+
     @KernelBaseTiming.timeit(level=1, prefix="[API] ")
     def predict(self, x, get_raw_results=False, gram_provided=False):
-        if not gram_provided:
-            x = self._kernel(self._x, np.atleast_2d(x))
-        y_pred = self._w.dot(x) + self._b
+        if self._approximation is not None:
+            y_pred = self._linear.predict(self._approximation.transform(x), get_raw_results=True)
+        elif not gram_provided:
+            y_pred = self._kernel_dot(x, self._w) + self._b
+        else:
+            y_pred = self._w.dot(x) + self._b
         if not get_raw_results:
             return np.sign(y_pred)
         return y_pred
 
 
 class GDKernelBase(KernelBase, GDBase):
-    """ Kernel classifier with gradient descent algorithm """
+    """
+        Kernel classifier with gradient descent algorithm
+        Gradient descent never drives alphas exactly to 0, so only samples with |alpha| > sv_tol * max |alpha|
+          are kept as support vectors (sv_tol=0 keeps every training sample)
+        No prediction cache is kept: every optimizer step changes all alphas (gradients are sums of Gram rows),
+          so a rank-k update of K.alpha + b would cost O(n^2) per step, while predictions of a batch only read
+          its own Gram rows (O(batch_size * n))
+    """
 
     GDKernelBaseTiming = Timing()
 
@@ -953,15 +1024,21 @@ class GDKernelBase(KernelBase, GDBase):
         self._optimizer = kwargs.get("optimizer", "Adam")
         self._train_repeat = 0
 
+        self._params["sv_tol"] = kwargs.get("sv_tol", 1e-3)
+
     def _prepare(self, sample_weight, **kwargs):
         lr = kwargs.get("lr", self._params["lr"])
-        self._alpha = np.random.random(len(self._x)).astype(np.float32)
+        self._alpha = np.random.random(len(self._y)).astype(np.float32)
         self._b = np.random.random(1).astype(np.float32)
         self._model_parameters = [self._alpha, self._b]
         self._optimizer = OptFactory().get_optimizer_by_name(
             self._optimizer, self._model_parameters, lr, self._params["epoch"]
         )
 
+    def _support_coef(self):
+        abs_alpha = np.abs(self._alpha)
+        return np.where(abs_alpha > self._params["sv_tol"] * abs_alpha.max(), self._alpha, 0)
+
     @GDKernelBaseTiming.timeit(level=1, prefix="[Core] ")
     def _fit(self, sample_weight, tol):
         if self._train_repeat == 0:
@@ -975,11 +1052,14 @@ class GDKernelBase(KernelBase, GDBase):
 
     @GDKernelBaseTiming.timeit(level=1, prefix="[API] ")
     def predict(self, x, get_raw_results=False, gram_provided=False):
-        if not gram_provided:
-            x = self._kernel(self._x, np.atleast_2d(x))
-        elif self._alpha.shape[0] != x.shape[0]:
-            x = x.T
-        y_pred = (self._alpha.dot(x) + self._b).ravel()
+        if self._approximation is not None:
+            y_pred = self._linear.predict(self._approximation.transform(x), get_raw_results=True)
+        elif not gram_provided:
+            y_pred = (self._kernel_dot(x, self._alpha) + self._b).ravel()
+        else:
+            if self._alpha.shape[0] != x.shape[0]:
+                x = x.T
+            y_pred = (self._alpha.dot(x) + self._b).ravel()
         if not get_raw_results:
             return np.sign(y_pred)
         return y_pred
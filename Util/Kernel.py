@@ -0,0 +1,308 @@
+import numpy as np
+from collections import OrderedDict
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+
+def issparse(x):
+    return sparse is not None and sparse.issparse(x)
+
+
+def as_matrix(x):
+    """ 2d version of x; scipy.sparse matrices are kept sparse (in CSR format, which slices rows cheaply) """
+    if issparse(x):
+        return x.tocsr()
+    return np.atleast_2d(x)
+
+
+class Kernel:
+    """
+        Kernel matrices computed block by block with BLAS
+        Squared distances use the expansion ||x||^2 + ||y||^2 - 2xy^T, so each block costs one matrix
+          product instead of materializing the (n x m x d) differences
+        Rows of x are processed in blocks so that one (block_size x m) block stays within memory_budget
+          bytes, unless block_size is given explicitly
+        Usage:
+            1) kernel(x, y)       : full kernel matrix K(x, y)
+            2) kernel.dot(x, y, w): K(x, y).dot(w) without building K(x, y)
+            3) kernel.blocks(x, y): yields (start, end, K(x[start:end], y))
+        Supported kernels:
+            1) "linear" : xy^T
+            2) "poly"   : (xy^T + 1)^p
+            3) "rbf"    : exp(-gamma * ||x - y||^2)
+        x & y may be scipy.sparse matrices (kernel blocks are always dense)
+    """
+
+    def __init__(self, name="rbf", gamma=None, p=3, block_size=None, memory_budget=2 ** 27):
+        if name not in ("linear", "poly", "rbf"):
+            raise NotImplementedError("Kernel '{}' has not defined".format(name))
+        self.name, self.gamma, self.p = name, gamma, p
+        self.block_size, self.memory_budget = block_size, memory_budget
+
+    def __str__(self):
+        if self.name == "rbf":
+            return "Kernel(rbf, gamma={})".format(self.gamma)
+        if self.name == "poly":
+            return "Kernel(poly, p={})".format(self.p)
+        return "Kernel(linear)"
+
+    __repr__ = __str__
+
+    def __call__(self, x, y, x_norms=None, y_norms=None):
+        x, y = as_matrix(x), as_matrix(y)
+        if y_norms is None and self.name == "rbf":
+            y_norms = Kernel.sq_norms(y)
+        rs = np.empty((x.shape[0], y.shape[0]), dtype=self._dtype(x, y))
+        for start, end, block in self.blocks(x, y, x_norms, y_norms):
+            rs[start:end] = block
+        return rs
+
+    @staticmethod
+    def sq_norms(x):
+        x = as_matrix(x)
+        if issparse(x):
+            return np.asarray(x.multiply(x).sum(axis=1)).ravel()
+        return np.einsum("ij,ij->i", x, x)
+
+    @staticmethod
+    def _dtype(x, y):
+        return np.result_type(x.dtype, y.dtype, np.float32)
+
+    def get_block_size(self, n_cols, itemsize=8):
+        if self.block_size is not None:
+            return max(1, int(self.block_size))
+        return max(1, int(self.memory_budget // max(1, n_cols * itemsize)))
+
+    def compute(self, x, y, x_norms=None, y_norms=None):
+        """ Kernel matrix of a single block (no splitting) """
+        dtype = self._dtype(x, y)
+        if issparse(x) or issparse(y):
+            rs = x @ y.T
+            rs = np.asarray(rs.toarray() if issparse(rs) else rs, dtype=dtype)
+        else:
+            rs = np.asarray(x.dot(y.T), dtype=dtype)
+        if self.name == "linear":
+            return rs
+        if self.name == "poly":
+            rs += 1
+            rs **= self.p
+            return rs
+        if x_norms is None:
+            x_norms = Kernel.sq_norms(x)
+        if y_norms is None:
+            y_norms = Kernel.sq_norms(y)
+        rs *= -2
+        rs += x_norms[..., None]
+        rs += y_norms
+        np.maximum(rs, 0, out=rs)
+        rs *= -self.gamma
+        return np.exp(rs, out=rs)
+
+    def blocks(self, x, y, x_norms=None, y_norms=None):
+        x, y = as_matrix(x), as_matrix(y)
+        if self.name == "rbf":
+            if x_norms is None:
+                x_norms = Kernel.sq_norms(x)
+            if y_norms is None:
+                y_norms = Kernel.sq_norms(y)
+        block_size = self.get_block_size(y.shape[0], self._dtype(x, y).itemsize)
+        for start in range(0, x.shape[0], block_size):
+            end = min(start + block_size, x.shape[0])
+            local_norms = None if x_norms is None else x_norms[start:end]
+            yield start, end, self.compute(x[start:end], y, local_norms, y_norms)
+
+    def dot(self, x, y, w, x_norms=None, y_norms=None):
+        """ K(x, y).dot(w), block by block """
+        x, y = as_matrix(x), as_matrix(y)
+        w = np.asarray(w)
+        rs = np.empty((x.shape[0],) + w.shape[1:], dtype=np.result_type(self._dtype(x, y), w.dtype))
+        for start, end, block in self.blocks(x, y, x_norms, y_norms):
+            rs[start:end] = block.dot(w)
+        return rs
+
+
+class KernelCache:
+    """
+        On-demand rows of the Gram matrix K(x, x), kept in an LRU cache bounded by cache_size bytes
+          (like libsvm's kernel cache), so solvers which only touch a few rows per step need
+          O(cache_size) memory instead of O(n^2)
+        Indexing mimics a numpy Gram matrix:
+            1) cache[i]         : i-th row
+            2) cache[[i, j...]] : stacked rows (missing ones are computed together in one block)
+            3) cache.diagonal() : K(x_i, x_i) for every i, computed without any row
+    """
+
+    def __init__(self, kernel, x, cache_size=2 ** 28):
+        self.kernel, self.x = kernel, as_matrix(x)
+        self.norms = Kernel.sq_norms(self.x)
+        self._rows = OrderedDict()
+        itemsize = np.result_type(self.x.dtype, np.float32).itemsize
+        self.max_rows = max(2, int(cache_size // max(1, self.x.shape[0] * itemsize)))
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return self.x.shape[0]
+
+    def __str__(self):
+        return "KernelCache({} / {} rows)".format(len(self._rows), self.max_rows)
+
+    __repr__ = __str__
+
+    @property
+    def shape(self):
+        return self.x.shape[0], self.x.shape[0]
+
+    def _insert(self, idx, row):
+        self._rows[idx] = row
+        while len(self._rows) > self.max_rows:
+            self._rows.popitem(last=False)
+
+    def _compute(self, indices):
+        return self.kernel.compute(self.x[indices], self.x, self.norms[indices], self.norms)
+
+    def get_row(self, idx):
+        idx = int(idx)
+        row = self._rows.get(idx)
+        if row is None:
+            self.misses += 1
+            row = self._compute([idx])[0]
+            self._insert(idx, row)
+        else:
+            self.hits += 1
+            self._rows.move_to_end(idx)
+        return row
+
+    def get_rows(self, indices):
+        indices = [int(idx) for idx in indices]
+        missing = sorted({idx for idx in indices if idx not in self._rows})
+        self.misses += len(missing)
+        self.hits += len(indices) - len(missing)
+        computed = {}
+        for start in range(0, len(missing), self.max_rows):
+            local = missing[start:start + self.max_rows]
+            for idx, row in zip(local, self._compute(local)):
+                computed[idx] = row
+        rs = np.empty((len(indices), self.x.shape[0]), dtype=np.result_type(self.x.dtype, np.float32))
+        for i, idx in enumerate(indices):
+            row = computed.get(idx)
+            if row is None:
+                row = self._rows[idx]
+                self._rows.move_to_end(idx)
+            rs[i] = row
+        for idx in missing[-self.max_rows:]:
+            # Copy so that cached rows do not keep whole computed blocks alive
+            self._insert(idx, computed[idx].copy())
+        return rs
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.get_row(item)
+        return self.get_rows(np.asarray(item).ravel())
+
+    def diagonal(self):
+        if self.kernel.name == "rbf":
+            return np.ones(self.x.shape[0])
+        if self.kernel.name == "poly":
+            return (self.norms + 1) ** self.kernel.p
+        return self.norms.copy()
+
+    def clear(self):
+        self._rows = OrderedDict()
+
+    def subset(self, indices):
+        return KernelCacheView(self, indices)
+
+
+class KernelCacheView:
+    """
+        Gram matrix of a subset of the samples of a KernelCache, served from (and filling) the parent cache,
+          so that sub-problems sharing samples & kernel (e.g. one-vs-one pairs) share computed rows
+    """
+
+    def __init__(self, cache, indices):
+        self.cache, self.indices = cache, np.asarray(indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __str__(self):
+        return "KernelCacheView({} / {} samples)".format(len(self.indices), len(self.cache))
+
+    __repr__ = __str__
+
+    @property
+    def shape(self):
+        return len(self.indices), len(self.indices)
+
+    def get_row(self, idx):
+        return self.cache.get_row(self.indices[int(idx)])[self.indices]
+
+    def get_rows(self, indices):
+        return self.cache.get_rows(self.indices[np.asarray(indices, dtype=np.int64)])[..., self.indices]
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.get_row(item)
+        return self.get_rows(np.asarray(item).ravel())
+
+    def diagonal(self):
+        return self.cache.diagonal()[self.indices]
+
+
+class KernelApproximation:
+    """
+        Explicit low-rank feature map z(x) with z(x)z(y)^T ~ K(x, y), so that a linear model trained on z(x)
+          approximates the kernel model with training & prediction costs linear in the number of samples
+        Supported methods:
+            1) "rff"      : random Fourier features, z(x) = sqrt(2 / D) * cos(xW + b) with W ~ N(0, 2 * gamma)
+                              and b ~ U(0, 2 * pi) (rbf kernel only)
+            2) "nystroem" : z(x) = K(x, landmarks) * K(landmarks, landmarks)^(-1/2), where landmarks are
+                              n_components training samples drawn at random (any kernel)
+    """
+
+    def __init__(self, kernel, method="rff", n_components=100):
+        if method not in ("rff", "nystroem"):
+            raise NotImplementedError("Approximation '{}' has not defined".format(method))
+        if method == "rff" and kernel.name != "rbf":
+            raise NotImplementedError("Random Fourier features are only defined for rbf kernel")
+        self.kernel, self.method, self.n_components = kernel, method, n_components
+        self.output_dim = None
+        self._weights = self._offsets = None
+        self._landmarks = self._landmark_norms = self._normalization = None
+
+    def __str__(self):
+        return "KernelApproximation({}, {}, n_components={})".format(self.method, self.kernel, self.n_components)
+
+    __repr__ = __str__
+
+    def fit(self, x):
+        x = as_matrix(x)
+        if self.method == "rff":
+            self._weights = np.random.normal(
+                scale=np.sqrt(2 * self.kernel.gamma), size=(x.shape[1], self.n_components))
+            self._offsets = np.random.uniform(0, 2 * np.pi, self.n_components)
+        else:
+            n_components = min(self.n_components, x.shape[0])
+            self._landmarks = x[np.random.choice(x.shape[0], n_components, replace=False)]
+            self._landmark_norms = Kernel.sq_norms(self._landmarks)
+            gram = self.kernel(self._landmarks, self._landmarks, self._landmark_norms, self._landmark_norms)
+            s, u = np.linalg.eigh(gram)
+            s = np.maximum(s, 1e-12 * max(1., s.max()))
+            self._normalization = (u / np.sqrt(s)).dot(u.T)
+        self.output_dim = self.n_components if self.method == "rff" else self._landmarks.shape[0]
+        return self
+
+    def transform(self, x):
+        x = as_matrix(x)
+        if self.method == "rff":
+            rs = np.asarray(x.dot(self._weights))
+            rs += self._offsets
+            np.cos(rs, out=rs)
+            rs *= np.sqrt(2 / self.n_components)
+            return rs
+        return self.kernel.dot(x, self._landmarks, self._normalization, y_norms=self._landmark_norms)
+
+    def fit_transform(self, x):
+        return self.fit(x).transform(x)
@@ -0,0 +1,269 @@
+import atexit
+import pickle
+import weakref
+import itertools
+import multiprocessing
+import numpy as np
+from functools import reduce
+from collections import OrderedDict
+from multiprocessing import Pool, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+_blocks = {}
+_models = OrderedDict()
+_model_cache_size = 16
+
+
+def _attach(name):
+    block = _blocks.get(name)
+    if block is None:
+        block = _blocks[name] = SharedMemory(name=name)
+    return block
+
+
+def _detach_stale(name):
+    for key in [key for key in _blocks if key != name]:
+        _blocks.pop(key).close()
+
+
+def _get_models(key, name, size):
+    models = _models.get(key)
+    if models is None:
+        block = SharedMemory(name=name)
+        models = _models[key] = pickle.loads(bytes(block.buf[:size]))
+        block.close()
+        while len(_models) > _model_cache_size:
+            _models.popitem(last=False)
+    else:
+        _models.move_to_end(key)
+    return models
+
+
+def _init_worker():
+    # Pools inherited from the parent process are not ours to manage
+    WorkerPool._pools = {}
+    WorkerPool._instances = weakref.WeakSet()
+
+
+def _view(x_info):
+    if isinstance(x_info, np.ndarray):
+        return x_info
+    name, offset, shape, dtype = x_info
+    _detach_stale(name)
+    return np.ndarray(shape, dtype=dtype, buffer=_attach(name).buf, offset=offset)
+
+
+def _run_data_task(args):
+    task, x_info, task_args = args
+    return task((_view(x_info), task_args, 1))
+
+
+def _run_shard_task(args):
+    i, from_data, shard = args
+    if callable(shard):
+        shard = shard()
+    return i, from_data(*shard)
+
+
+def _run_task(args):
+    task, (key, model_name, model_size, start, end), x_info = args
+    x = _view(x_info)
+    models = _get_models(key, model_name, model_size)
+    if start is None:
+        return task((x, models[0], 1))
+    return task((x, models[start:end], 1))
+
+
+class WorkerPool:
+    """
+        Persistent process pool used by parallel predictions
+        The pool is started lazily on the first parallel call and kept alive until shutdown, so
+          predictions no longer pay process-spawn cost per call
+        Zero-copy dispatch:
+            1) Fitted models are pickled once into a shared memory block when they are first dispatched
+               (publish); every worker un-pickles them once and keeps them cached by key
+            2) Inputs are written into a single shared memory block (reused across calls, only grows),
+               which workers view as numpy arrays (dtype preserved) by offset
+          So per-call IPC is reduced to (model key, model indices, block offset / shape / dtype)
+        Usage:
+            1) WorkerPool.get(n_cores)      : shared pool (one per n_cores) reused across models
+            2) with WorkerPool(n_cores) as  : private pool which is shut down on exit
+            3) WorkerPool.release(*models)  : drop published copies of (re-fitted) models from every pool
+            4) WorkerPool.shutdown_all()    : shut down every shared pool (registered at exit)
+        Besides predictions, imap_data runs independent jobs (e.g. growing trees) on a staged input, and imap
+          runs jobs which load their own inputs (e.g. statistics of local data shards)
+    """
+
+    _pools = {}
+    _instances = weakref.WeakSet()
+    _keys = itertools.count()
+
+    def __init__(self, n_cores=None):
+        if n_cores is None or n_cores <= 0:
+            n_cores = multiprocessing.cpu_count()
+        self._n_cores = n_cores
+        self._pool = self._block = None
+        self._published = {}
+        WorkerPool._instances.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def __str__(self):
+        return "WorkerPool({})".format(self._n_cores)
+
+    __repr__ = __str__
+
+    @property
+    def n_cores(self):
+        return self._n_cores
+
+    @property
+    def started(self):
+        return self._pool is not None
+
+    @classmethod
+    def get(cls, n_cores=None):
+        if n_cores is None or n_cores <= 0:
+            n_cores = multiprocessing.cpu_count()
+        pool = cls._pools.get(n_cores)
+        if pool is None:
+            pool = cls._pools[n_cores] = cls(n_cores)
+        return pool
+
+    @classmethod
+    def shutdown_all(cls):
+        for pool in list(cls._instances):
+            pool.shutdown()
+        cls._pools = {}
+
+    @classmethod
+    def release(cls, *models):
+        ids = {id(model) for model in models}
+        for pool in list(cls._instances):
+            for ref_ids in [ref_ids for ref_ids in pool._published if ids & set(ref_ids)]:
+                pool._unpublish(ref_ids)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        for ref_ids in list(self._published):
+            self._unpublish(ref_ids)
+        if self._block is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+    # Models
+
+    def _unpublish(self, ref_ids):
+        block = self._published.pop(ref_ids)[2]
+        block.close()
+        block.unlink()
+
+    def _discard(self, ref_ids):
+        if ref_ids in self._published:
+            self._unpublish(ref_ids)
+
+    def publish(self, models):
+        ref_ids = tuple(id(model) for model in models)
+        record = self._published.get(ref_ids)
+        if record is not None:
+            key, refs, block, size = record
+            if all(ref() is model for ref, model in zip(refs, models)):
+                return key, block.name, size
+            self._unpublish(ref_ids)
+        data = pickle.dumps(list(models), protocol=pickle.HIGHEST_PROTOCOL)
+        block = SharedMemory(create=True, size=max(len(data), 1))
+        block.buf[:len(data)] = data
+        key = next(WorkerPool._keys)
+        refs = [weakref.ref(model, lambda _, _ids=ref_ids: self._discard(_ids)) for model in models]
+        self._published[ref_ids] = (key, refs, block, len(data))
+        return key, block.name, len(data)
+
+    # Inputs
+
+    def _start(self):
+        if self._pool is None:
+            # Workers must share our resource tracker, otherwise they unlink the blocks when they exit
+            resource_tracker.ensure_running()
+            self._pool = Pool(self._n_cores, initializer=_init_worker)
+
+    def _stage(self, x):
+        self._start()
+        if x.dtype.hasobject:
+            return lambda start, shape: x[start:start + shape[0]]
+        if self._block is None or x.nbytes > self._block.size:
+            size = max(x.nbytes, 1)
+            if self._block is not None:
+                size = max(size, 2 * self._block.size)
+                self._block.close()
+                self._block.unlink()
+            self._block = SharedMemory(create=True, size=size)
+        np.ndarray(x.shape, dtype=x.dtype, buffer=self._block.buf)[:] = x
+        row_bytes = x.dtype.itemsize * int(np.prod(x.shape[1:]))
+        name, dtype = self._block.name, x.dtype.str
+        return lambda start, shape: (name, start * row_bytes, shape, dtype)
+
+    def _split(self, n):
+        bounds = np.linspace(0, n, self._n_cores + 1).astype(np.int64)
+        return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+    def map_data(self, x, task, model):
+        """ Split rows of x across workers; each worker calls task((x_batch, model, 1)) """
+        x = np.ascontiguousarray(np.atleast_2d(x))
+        view = self._stage(x)
+        key, name, size = self.publish([model])
+        return self._pool.map(_run_task, [
+            (task, (key, name, size, None, None), view(start, (end - start,) + x.shape[1:]))
+            for start, end in self._split(len(x))
+        ])
+
+    def map_clfs(self, x, task, clfs):
+        """ Split clfs across workers; each worker calls task((x, clfs_batch, 1)) on the whole x """
+        x = np.ascontiguousarray(np.atleast_2d(x))
+        view = self._stage(x)
+        key, name, size = self.publish(clfs)
+        x_info = view(0, x.shape)
+        return self._pool.map(_run_task, [
+            (task, (key, name, size, start, end), x_info) for start, end in self._split(len(clfs))
+        ])
+
+    def imap_data(self, x, task, args_lst):
+        """ Call task((x, args, 1)) for every args on workers; results are yielded as they complete """
+        x = np.ascontiguousarray(np.atleast_2d(x))
+        x_info = self._stage(x)(0, x.shape)
+        return self._pool.imap_unordered(_run_data_task, [(task, x_info, args) for args in args_lst])
+
+    def imap(self, task, args_lst):
+        """ Call task(args) for every args on workers; results are yielded as they complete """
+        self._start()
+        return self._pool.imap_unordered(task, args_lst)
+
+
+def map_reduce(from_data, shards, n_jobs=1):
+    """
+        Map-reduce over data shards: from_data(*shard) is computed for every shard by n_jobs processes
+          (1: in this process, <= 0: all cores), then results are merged (a.merge(b)) in the order of shards
+        :param from_data : Callable returning mergeable statistics, must be picklable if n_jobs != 1
+                             (e.g. a staticmethod, or a functools.partial of one)
+        :param shards    : Tuples of arguments, or callables returning them (so that every worker loads its
+                             own shard)
+    """
+    args_lst = [(i, from_data, shard) for i, shard in enumerate(shards)]
+    if n_jobs == 1:
+        results = map(_run_shard_task, args_lst)
+    else:
+        results = WorkerPool.get(n_jobs).imap(_run_shard_task, args_lst)
+    stats = [None] * len(args_lst)
+    for i, local_stats in results:
+        stats[i] = local_stats
+    return reduce(lambda a, b: a.merge(b), stats)
+
+
+atexit.register(WorkerPool.shutdown_all)
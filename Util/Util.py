@@ -73,6 +73,134 @@ class Util:
             return entry, output
 
 
+class CategoricalEncoder:
+    """
+        Column-wise categorical encoder
+        Vocabularies are fitted with np.unique(..., return_inverse=True) and whole columns are transformed at
+          once (binary search in the sorted vocabulary), instead of looking every cell up in a dict
+        Continuous columns (wc, "whether continuous") are only cast to float32, and values missing from a
+          vocabulary are encoded as unknown_code
+        Usage:
+            1) encoder.fit_transform(x)        : fit vocabularies & encode x
+            2) encoder.transform(x)            : encode new data ((discrete, continuous) if separate)
+            3) encoder.save(path) / .load(path) : persist with pickle
+    """
+
+    def __init__(self, wc=None, continuous_rate=0.1, unknown_code=-1):
+        self.wc = None if wc is None else np.asarray(wc, dtype=np.bool_)
+        self.continuous_rate, self.unknown_code = continuous_rate, unknown_code
+        self.uniques = self.categories = self.codes = None
+
+    def __str__(self):
+        if self.wc is None:
+            return "CategoricalEncoder(not fitted)"
+        return "CategoricalEncoder({} discrete, {} continuous)".format(int(np.sum(~self.wc)), int(np.sum(self.wc)))
+
+    __repr__ = __str__
+
+    @staticmethod
+    def from_feat_dicts(wc, feat_dicts, unknown_code=-1):
+        """ Encoder equivalent to feat_dicts (one {value: code} dict per column, None for continuous ones) """
+        encoder = CategoricalEncoder(wc, unknown_code=unknown_code)
+        encoder.categories, encoder.codes = [], []
+        for feat_dict in feat_dicts:
+            if feat_dict is None:
+                encoder.categories.append(None)
+                encoder.codes.append(None)
+            else:
+                values = sorted(feat_dict)
+                encoder.categories.append(np.array(values))
+                encoder.codes.append(np.array([feat_dict[value] for value in values], dtype=np.int64))
+        encoder.uniques = list(encoder.categories)
+        return encoder
+
+    @property
+    def n_possibilities(self):
+        return [None if categories is None else len(categories) for categories in self.categories]
+
+    @property
+    def feat_dicts(self):
+        return [
+            None if categories is None else dict(zip(categories.tolist(), codes.tolist()))
+            for categories, codes in zip(self.categories, self.codes)
+        ]
+
+    @staticmethod
+    def _columns(x):
+        if isinstance(x, np.ndarray):
+            return np.atleast_2d(x).T
+        if len(x) and np.ndim(x[0]) == 0:
+            x = [x]
+        # Columns of lists are built separately, so that their types are not mixed up
+        return [np.array(column) for column in zip(*x)]
+
+    def _cast(self, i, column):
+        categories = self.categories[i]
+        if (column.dtype.kind in "US") != (categories.dtype.kind in "US"):
+            return column.astype(categories.dtype)
+        return column
+
+    def _encode(self, i, column):
+        categories, codes = self.categories[i], self.codes[i]
+        column = self._cast(i, column)
+        positions = np.searchsorted(categories, column)
+        np.minimum(positions, len(categories) - 1, out=positions)
+        rs = codes[positions]
+        rs[categories[positions] != column] = self.unknown_code
+        return rs
+
+    def _fit(self, columns, return_inverse):
+        n_sample = len(columns[0]) if len(columns) else 0
+        if return_inverse:
+            self.uniques, inverses = zip(*[np.unique(column, return_inverse=True) for column in columns])
+        else:
+            self.uniques, inverses = [np.unique(column) for column in columns], None
+        self.uniques = list(self.uniques)
+        if self.wc is None:
+            self.wc = np.array([len(values) >= int(self.continuous_rate * n_sample) for values in self.uniques])
+        self.categories = [None if wc else values for values, wc in zip(self.uniques, self.wc)]
+        self.codes = [None if wc else np.arange(len(values)) for values, wc in zip(self.uniques, self.wc)]
+        return inverses
+
+    def fit(self, x):
+        self._fit(self._columns(x), False)
+        return self
+
+    def fit_transform(self, x, separate=False):
+        columns = self._columns(x)
+        inverses = self._fit(columns, True)
+        return self._stack(columns, [inverse.ravel() for inverse in inverses], separate)
+
+    def transform(self, x, separate=False):
+        columns = self._columns(x)
+        return self._stack(columns, [
+            None if self.wc[i] else self._encode(i, np.asarray(column)) for i, column in enumerate(columns)
+        ], separate)
+
+    def _stack(self, columns, codes, separate):
+        n_sample = len(columns[0]) if len(columns) else 0
+        discrete = np.array([code for code, wc in zip(codes, self.wc) if not wc], dtype=np.int64)
+        discrete = discrete.T.reshape(n_sample, int(np.sum(~self.wc)))
+        continuous = np.array([column for column, wc in zip(columns, self.wc) if wc], dtype=np.float32)
+        continuous = continuous.T.reshape(n_sample, int(np.sum(self.wc)))
+        if separate:
+            return discrete, continuous
+        if not np.any(self.wc):
+            return discrete
+        rs = np.empty((n_sample, len(self.wc)), dtype=np.float32)
+        rs[..., ~self.wc], rs[..., self.wc] = discrete, continuous
+        return rs
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+
 class DataUtil:
     naive_sets = {
         "mushroom", "balloon", "mnist", "cifar", "test"
@@ -279,46 +407,21 @@ class DataUtil:
         )
 
     @staticmethod
-    def quantize_data(x, y, wc=None, continuous_rate=0.1, separate=False):
-        if isinstance(x, list):
-            xt = map(list, zip(*x))
-        else:
-            xt = x.T
-        features = [set(feat) for feat in xt]
-        if wc is None:
-            wc = np.array([len(feat) >= int(continuous_rate * len(y)) for feat in features])
-        else:
-            wc = np.asarray(wc)
-        feat_dicts = [
-            {_l: i for i, _l in enumerate(feats)} if not wc[i] else None
-            for i, feats in enumerate(features)
-        ]
-        if not separate:
-            if np.all(~wc):
-                dtype = np.int
-            else:
-                dtype = np.float32
-            x = np.array([[feat_dicts[i][_l] if not wc[i] else _l for i, _l in enumerate(sample)]
-                          for sample in x], dtype=dtype)
-        else:
-            x = np.array([[feat_dicts[i][_l] if not wc[i] else _l for i, _l in enumerate(sample)]
-                          for sample in x], dtype=np.float32)
-            x = (x[:, ~wc].astype(np.int), x[:, wc])
-        label_dict = {l: i for i, l in enumerate(set(y))}
-        y = np.array([label_dict[yy] for yy in y], dtype=np.int8)
-        label_dict = {i: l for l, i in label_dict.items()}
-        return x, y, wc, features, feat_dicts, label_dict
+    def quantize_data(x, y, wc=None, continuous_rate=0.1, separate=False, encoder=None):
+        """ See CategoricalEncoder (fitted in place if provided); features & feat_dicts are kept for compatibility """
+        if encoder is None:
+            encoder = CategoricalEncoder(wc, continuous_rate)
+        x = encoder.fit_transform(x, separate)
+        features = [set(values) for values in encoder.uniques]
+        labels, y = np.unique(y, return_inverse=True)
+        label_dict = {i: l for i, l in enumerate(labels)}
+        return x, y.ravel().astype(np.int8), encoder.wc, features, encoder.feat_dicts, label_dict
 
     @staticmethod
     def transform_data(x, y, wc, feat_dicts, label_dict):
-        if np.all(~wc):
-            dtype = np.int
-        else:
-            dtype = np.float32
-        label_dict = {l: i for i, l in label_dict.items()}
-        x = np.array([[feat_dicts[i][_l] if not wc[i] else _l for i, _l in enumerate(sample)]
-                      for sample in x], dtype=dtype)
-        y = np.array([label_dict[yy] for yy in y], dtype=np.int8)
+        x = CategoricalEncoder.from_feat_dicts(wc, feat_dicts).transform(x)
+        label_encoder = CategoricalEncoder.from_feat_dicts([False], [{l: i for i, l in label_dict.items()}])
+        y = label_encoder.transform(np.asarray(y)[..., None]).ravel().astype(np.int8)
         return x, y
 
 
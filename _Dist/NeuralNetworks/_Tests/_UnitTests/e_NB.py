@@ -0,0 +1,48 @@
+import os
+import sys
+root_path = os.path.abspath("../../../../")
+if root_path not in sys.path:
+    sys.path.append(root_path)
+
+import unittest
+import numpy as np
+
+from _Dist.NeuralNetworks.b_TraditionalML.MultinomialNB import MultinomialNB, NBStats
+
+
+x = np.random.randint(0, 10, [1000, 10])
+y = np.random.randint(0, 5, 1000)
+nb = MultinomialNB().fit(x, y)
+
+
+class TestMultinomialNB(unittest.TestCase):
+    def test_00_fit_shards(self):
+        shards = [(x[i:i + 300], y[i:i + 300]) for i in range(0, len(x), 300)]
+        for n_jobs in (1, 2):
+            sharded = MultinomialNB().fit_shards(shards, 5, enc=nb.enc, n_jobs=n_jobs)
+            self.assertTrue(np.allclose(nb.predict(x), sharded.predict(x)), "Sharded fit differs from fit")
+
+    def test_01_missing_classes(self):
+        # Class 4 is missing from every shard, class 2 from the first one
+        mask = y < 4
+        local_x, local_y = x[mask], y[mask]
+        shards = [(local_x[:300], np.where(local_y[:300] == 2, 0, local_y[:300])), (local_x[300:], local_y[300:])]
+        sharded = MultinomialNB().fit_shards(shards, 5, enc=nb.enc, n_jobs=2)
+        self.assertEqual(sharded.predict(x).shape, (len(x), 5), "Missing classes are dropped")
+        self.assertTrue(np.isneginf(sharded.class_log_prior[4]), "Missing class may be predicted")
+        self.assertTrue(np.all(sharded.predict_class(x) != 4), "Missing class is predicted")
+
+    def test_02_save_load(self):
+        stats = NBStats.from_data(nb.enc.transform(x), y, 5)
+        stats.save("_nb_stats.pkl")
+        try:
+            loaded = NBStats.load("_nb_stats.pkl")
+        finally:
+            os.remove("_nb_stats.pkl")
+        self.assertTrue(np.allclose(
+            MultinomialNB().fit_stats(loaded).predict(nb.enc.transform(x)), nb.predict(x)
+        ), "Loaded statistics differ")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,103 @@
+import pickle
 import numpy as np
+from functools import partial
+from scipy.sparse import issparse
 from sklearn.preprocessing import OneHotEncoder
 
+from Util.Parallel import map_reduce
+
+
+class NBStats:
+    """ Sufficient statistics of MultinomialNB, which can be merged & serialized
+
+    Statistics of different shards (encoded with the same encoder) can be computed independently, e.g. by a
+    process pool, and merged (merge is associative & commutative) without reprocessing raw data
+
+    Parameters
+    ----------
+    class_counts : np.ndarray of float
+        Number of samples of every class
+
+    feature_counts : np.ndarray of float
+        Sum of the (encoded) feature vectors of every class, shape: (n_class, n_features)
+
+    """
+    def __init__(self, class_counts, feature_counts):
+        self.class_counts = np.asarray(class_counts, np.float64)
+        self.feature_counts = np.asarray(feature_counts, np.float64)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    @staticmethod
+    def from_data(x, y, n_classes=None, enc=None):
+        """ Statistics of one shard
+
+        Parameters
+        ----------
+        x : {np.ndarray of float, scipy.sparse.csr.csr_matrix of float}
+            Feature vectors, (one-hot) encoded unless enc is provided
+
+        y : {list of float, np.ndarray of float}
+            Labels, in range(n_classes)
+
+        n_classes : int, optional (default=None)
+            Number of classes, inferred from y if not provided (so it should be provided for shards, which may
+            not contain every class)
+
+        enc : OneHotEncoder, optional (default=None)
+            Fitted encoder used to transform x
+
+        Returns
+        -------
+        stats : NBStats
+            Returns statistics of x & y.
+
+        """
+        if enc is not None:
+            x = enc.transform(x)
+        elif not issparse(x):
+            x = np.array(x, np.float32)
+        y = np.array(y, np.int64)
+        if n_classes is None:
+            n_classes = np.max(y) + 1
+        one_hot = (y[..., None] == np.arange(n_classes)).astype(np.float64)
+        return NBStats(one_hot.sum(0), np.asarray(x.T.dot(one_hot)).T)
+
+    def merge(self, other):
+        """ Statistics of the union of both shards
+
+        Parameters
+        ----------
+        other : NBStats
+            Statistics of another shard
+
+        Returns
+        -------
+        stats : NBStats
+            Returns merged statistics (classes missing from one of the shards have zero counts there).
+
+        """
+        if self.feature_counts.shape[1] != other.feature_counts.shape[1]:
+            raise ValueError("Statistics of {} and {} features cannot be merged".format(
+                self.feature_counts.shape[1], other.feature_counts.shape[1]))
+        n_class = max(len(self.class_counts), len(other.class_counts))
+        class_counts = np.zeros(n_class)
+        feature_counts = np.zeros((n_class, self.feature_counts.shape[1]))
+        for stats in (self, other):
+            class_counts[:len(stats.class_counts)] += stats.class_counts
+            feature_counts[:len(stats.class_counts)] += stats.feature_counts
+        return NBStats(class_counts, feature_counts)
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
 
 class MultinomialNB:
     """ Naive Bayes algorithm with discrete inputs
@@ -15,6 +112,9 @@ class MultinomialNB:
     enc : OneHotEncoder
         One-Hot encoder used to transform (discrete) inputs
 
+    stats : NBStats
+        Sufficient statistics of the training data
+
     class_log_prior : np.ndarray of float
         Log class prior used to calculate (linear) prediction
 
@@ -29,11 +129,13 @@ class MultinomialNB:
     >>> nb = MultinomialNB().fit(x, y)            #  fit the model
     >>> nb.predict(x)                             #  (linear) prediction
     >>> nb.predict_class(x)                       #  predict labels
+    >>> shards = [(x[:500], y[:500]), (x[500:], y[500:])]
+    >>> nb = MultinomialNB().fit_shards(shards, 5, enc=nb.enc, n_jobs=2)  #  map-reduce fit over shards
 
     """
     def __init__(self, alpha=1.):
         self.alpha = alpha
-        self.enc = self.class_log_prior = self.feature_log_prob = None
+        self.enc = self.stats = self.class_log_prior = self.feature_log_prob = None
 
     def fit(self, x, y, do_one_hot=True):
         """ Fit the model with x & y
@@ -63,16 +165,57 @@ class MultinomialNB:
         else:
             self.enc = None
             x = np.array(x, np.float32)
-        n = x.shape[0]
-        y = np.array(y, np.int8)
-        self.class_log_prior = np.log(np.bincount(y) / n)
-        masks = [y == i for i in range(len(self.class_log_prior))]
-        masked_xs = [x[mask] for mask in masks]
-        feature_counts = np.array([np.asarray(masked_x.sum(0))[0] for masked_x in masked_xs])
-        smoothed_fc = feature_counts + self.alpha
+        return self.fit_stats(NBStats.from_data(x, y))
+
+    def fit_stats(self, stats):
+        """ Fit the model with sufficient statistics
+
+        Parameters
+        ----------
+        stats : NBStats
+            Statistics of the training data
+
+        Returns
+        -------
+        self : MultinomialNB
+            Returns self.
+
+        """
+        self.stats = stats
+        with np.errstate(divide="ignore"):
+            # Classes without samples are never predicted
+            self.class_log_prior = np.log(stats.class_counts / stats.class_counts.sum())
+        smoothed_fc = stats.feature_counts + self.alpha
         self.feature_log_prob = np.log(smoothed_fc / smoothed_fc.sum(1, keepdims=True))
         return self
 
+    def fit_shards(self, shards, n_classes, enc=None, n_jobs=1):
+        """ Map-reduce fit: statistics of every shard are computed by n_jobs processes, then merged
+
+        Parameters
+        ----------
+        shards : list of {tuple, callable}
+            (x, y) tuples, or callables returning them (so that every worker loads its own shard)
+
+        n_classes : int
+            Number of classes, so that statistics of every shard share the same shape
+
+        enc : OneHotEncoder, optional (default=None)
+            Fitted encoder shared by all shards, inputs are used as they are if not provided
+
+        n_jobs : int, optional (default=1)
+            Number of processes (1: in this process, <= 0: all cores)
+
+        Returns
+        -------
+        self : MultinomialNB
+            Returns self.
+
+        """
+        self.enc = enc
+        from_data = partial(NBStats.from_data, n_classes=n_classes, enc=enc)
+        return self.fit_stats(map_reduce(from_data, shards, n_jobs))
+
     def _predict(self, x):
         """ Internal method for calculating (linear) predictions
 
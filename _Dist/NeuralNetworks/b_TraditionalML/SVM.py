@@ -9,6 +9,8 @@ import tensorflow as tf
 
 from _Dist.NeuralNetworks.DistBase import Base,  AutoBase, AutoMeta, DistMixin, DistMeta
 
+from Util.Kernel import Kernel, KernelApproximation
+
 
 class LinearSVM(Base):
     def __init__(self, *args, **kwargs):
@@ -61,36 +63,48 @@ class SVM(LinearSVM):
         self._name_appendix = "SVM"
         self._p = self._gamma = None
         self._x = self._gram = self._kernel_name = None
+        self._sv_x = self._sv_w = self._sv_b = self._sv_norms = None
+        self._approximation = None
 
     @property
     def kernel(self):
-        if self._kernel_name == "linear":
-            return self.linear
-        if self._kernel_name == "poly":
-            return lambda x, y: self.poly(x, y, self._p)
-        if self._kernel_name == "rbf":
-            return lambda x, y: self.rbf(x, y, self._gamma)
-        raise NotImplementedError("Kernel '{}' is not implemented".format(self._kernel_name))
+        if self._kernel_name not in ("linear", "poly", "rbf"):
+            raise NotImplementedError("Kernel '{}' is not implemented".format(self._kernel_name))
+        return Kernel(
+            self._kernel_name, gamma=self._gamma, p=self._p,
+            block_size=self.model_param_settings.get("block_size", None),
+            memory_budget=self.model_param_settings.get("memory_budget", 2 ** 27)
+        )
 
     @staticmethod
     def linear(x, y):
-        return x.dot(y.T)
+        return Kernel("linear")(x, y)
 
     @staticmethod
     def poly(x, y, p):
-        return (x.dot(y.T) + 1) ** p
+        return Kernel("poly", p=p)(x, y)
 
     @staticmethod
     def rbf(x, y, gamma):
-        return np.exp(-gamma * np.sum((x[..., None, :] - y) ** 2, axis=2))
+        return Kernel("rbf", gamma=gamma)(x, y)
 
     def init_from_data(self, x, y, x_test, y_test, sample_weights, names):
         self._x, y = np.atleast_2d(x).astype(np.float32), np.asarray(y, np.float32)
         self._p = self.model_param_settings.setdefault("p", 3)
         self._gamma = self.model_param_settings.setdefault("gamma", 1 / self._x.shape[1])
         self._kernel_name = self.model_param_settings.setdefault("kernel_name", "rbf")
-        self._gram, x_test = self.kernel(self._x, self._x), self.kernel(x_test, self._x)
-        super(SVM, self).init_from_data(self._gram, y, x_test, y_test, sample_weights, names)
+        approximation = self.model_param_settings.setdefault("approximation", None)
+        if approximation is None:
+            self._approximation = None
+            self._gram, x_test = self.kernel(self._x, self._x), self.kernel(x_test, self._x)
+            super(SVM, self).init_from_data(self._gram, y, x_test, y_test, sample_weights, names)
+        else:
+            # Train the linear model on an explicit low-rank feature map instead of the Gram matrix
+            n_components = self.model_param_settings.setdefault("n_components", 100)
+            self._gram = None
+            self._approximation = KernelApproximation(self.kernel, approximation, n_components).fit(self._x)
+            x, x_test = self._transform(self._x), self._transform(x_test)
+            super(SVM, self).init_from_data(x, y, x_test, y_test, sample_weights, names)
 
     def init_model_param_settings(self):
         super(SVM, self).init_model_param_settings()
@@ -100,9 +114,19 @@ class SVM(LinearSVM):
 
     def _define_py_collections(self):
         super(SVM, self)._define_py_collections()
-        self.py_collections += ["_x", "_gram"]
+        self.py_collections += ["_x", "_gram", "_sv_x", "_sv_w", "_sv_b", "_sv_norms", "_approximation"]
+
+    def _transform(self, x):
+        if x is None:
+            return None
+        if self._approximation is None:
+            return self.kernel(x, self._x)
+        return self._approximation.transform(np.atleast_2d(x).astype(np.float32)).astype(np.float32)
 
     def _define_loss_and_train_step(self):
+        if self._approximation is not None:
+            super(SVM, self)._define_loss_and_train_step()
+            return
         self._loss = self.c * tf.reduce_sum(tf.maximum(0., 1 - self._tfy * self._output)) + 0.5 * tf.matmul(
             self._ws[0], tf.matmul(self._gram, self._ws[0]), transpose_a=True
         )[0]
@@ -110,22 +134,52 @@ class SVM(LinearSVM):
             self._train_step = self._optimizer.minimize(self._loss)
 
     def _evaluate(self, x=None, y=None, x_cv=None, y_cv=None, x_test=None, y_test=None, metric=None):
-        n_sample = self._x.shape[0]
+        n_dim = self._x.shape[0] if self._approximation is None else self._approximation.output_dim
         cv_feat_dim = None if x_cv is None else x_cv.shape[1]
         test_feat_dim = None if x_test is None else x_test.shape[1]
-        x_cv = None if x_cv is None else self.kernel(x_cv, self._x) if cv_feat_dim != n_sample else x_cv
-        x_test = None if x_test is None else self.kernel(x_test, self._x) if test_feat_dim != n_sample else x_test
+        x_cv = None if x_cv is None else self._transform(x_cv) if cv_feat_dim != n_dim else x_cv
+        x_test = None if x_test is None else self._transform(x_test) if test_feat_dim != n_dim else x_test
         return super(SVM, self)._evaluate(x, y, x_cv, y_cv, x_test, y_test)
 
+    @property
+    def n_support(self):
+        return None if self._sv_x is None else len(self._sv_x)
+
+    def _compact(self):
+        """
+            Keep only the support vectors (|w| > sv_tol * max |w|) so that predictions only need K(x, support vectors)
+            Weights trained by gradient descent are hardly ever exactly 0, hence the relative threshold (default 1e-6)
+        """
+        if self._approximation is not None:
+            return
+        w, b = self._sess.run([self._ws[0], self._bs[0]])
+        w = w.ravel()
+        abs_w = np.abs(w)
+        support = np.flatnonzero(abs_w > self.model_param_settings.get("sv_tol", 1e-6) * abs_w.max())
+        self._sv_x, self._sv_w, self._sv_b = self._x[support], w[support], float(b.ravel()[0])
+        self._sv_norms = Kernel.sq_norms(self._sv_x) if self._kernel_name == "rbf" else None
+
+    def fit(self, x, y, x_test=None, y_test=None, sample_weights=None, names=("train", "test"),
+            timeit=True, time_limit=-1, snapshot_ratio=3, print_settings=True, verbose=1):
+        self._sv_x = self._sv_w = self._sv_b = self._sv_norms = None
+        super(SVM, self).fit(
+            x, y, x_test, y_test, sample_weights, names, timeit, time_limit, snapshot_ratio, print_settings, verbose
+        )
+        self._compact()
+        return self
+
     def predict(self, x):
-        # noinspection PyTypeChecker
-        return self._predict(self.kernel(x, self._x))
+        if self._sv_x is None:
+            # noinspection PyTypeChecker
+            return self._predict(self._transform(x))
+        x = np.atleast_2d(x).astype(np.float32)
+        return self.kernel.dot(x, self._sv_x, self._sv_w, y_norms=self._sv_norms) + self._sv_b
 
     def predict_classes(self, x):
         return (self.predict(x) >= 0).astype(np.int32)
 
     def evaluate(self, x, y, x_cv=None, y_cv=None, x_test=None, y_test=None, metric=None):
-        return self._evaluate(self.kernel(x, self._x), y, x_cv, y_cv, x_test, y_test, metric)
+        return self._evaluate(self._transform(x), y, x_cv, y_cv, x_test, y_test, metric)
 
 
 class AutoLinearSVM(AutoBase, LinearSVM, metaclass=AutoMeta):
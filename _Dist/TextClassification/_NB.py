@@ -2,8 +2,8 @@ import os
 import math
 import pickle
 import numpy as np
-from collections import Counter
 import matplotlib.pyplot as plt
+from scipy import sparse
 
 from sklearn import metrics
 
@@ -11,58 +11,66 @@ from _Dist.TextClassification.GenDataset import gen_dataset
 from Util.ProgressBar import ProgressBar
 
 
-def pick_best(sentence, prob_lst):
-    rs = [prob["prior"] for prob in prob_lst]
-    for j, _prob_dic in enumerate(prob_lst):
-        for word in sentence:
-            if word in _prob_dic:
-                rs[j] *= _prob_dic[word]
-            else:
-                rs[j] /= _prob_dic["null"]
-    return np.argmax(rs)
+_dataset = {}
+
+
+def get_doc_term(x):
+    """ Tokens are indexed into integer ids once, documents become rows of a CSR doc-term matrix (term counts) """
+    vocab = {}
+    indices = np.array([vocab.setdefault(word, len(vocab)) for sentence in x for word in sentence], dtype=np.int64)
+    indptr = np.cumsum([0] + [len(sentence) for sentence in x])
+    doc_term = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(x), len(vocab)))
+    doc_term.sum_duplicates()
+    return doc_term, vocab
+
+
+def load_dataset(dat_path):
+    if dat_path not in _dataset:
+        gen_dataset(dat_path)
+        with open(dat_path, "rb") as _file:
+            x, y = pickle.load(_file)
+        _dataset[dat_path] = get_doc_term(x)[0], np.array(y, dtype=np.int64)
+    return _dataset[dat_path]
+
+
+def pick_best(x, model):
+    """
+        argmax_j prior_j * prod_{word} p_j(word), where p_j(word) = 1 / null_j for words unseen in class j,
+          computed in log space for every row of the doc-term matrix x at once
+    """
+    log_prob, log_prior = model
+    return np.argmax(np.asarray(x.dot(log_prob.T)) + log_prior, axis=1)
 
 
 def train(power=6.46):
-    dat_path = os.path.join("_Data", "dataset.dat")
-    gen_dataset(dat_path)
-    with open(dat_path, "rb") as _file:
-        x, y = pickle.load(_file)
-    _indices = np.random.permutation(len(x))
-    x = [x[i] for i in _indices]
-    y = [y[i] for i in _indices]
-    data_len = len(x)
+    x, y = load_dataset(os.path.join("_Data", "dataset.dat"))
+    _indices = np.random.permutation(len(y))
+    x, y = x[_indices], y[_indices]
+    data_len = len(y)
     batch_size = math.ceil(data_len*0.1)
-    _test_sets, _prob_lists = [], []
-    _total = sum([len(sentence) for sentence in x])
+    _test_sets, _models = [], []
+    _total = x.sum()
+    # Class-term counts of the whole dataset; every fold only subtracts the counts of its test set
+    labels = sparse.csr_matrix((np.ones(data_len), (np.arange(data_len), y)), shape=(data_len, np.max(y) + 1))
+    _counts = labels.T.dot(x).toarray()
     for i in range(10):
-        rs = [[] for _ in range(9)]
         _next = (i+1)*batch_size if i != 9 else data_len
-        x_train = x[:i * batch_size] + x[(i + 1) * batch_size:]
-        y_train = y[:i * batch_size] + y[(i + 1) * batch_size:]
         x_test, y_test = x[i*batch_size:_next], y[i*batch_size:_next]
-        for xx, yy in zip(x_train, y_train):
-            rs[yy] += xx
-        _counters = [Counter(group) for group in rs]
+        counts = _counts - labels[i*batch_size:_next].T.dot(x_test).toarray()
+        _sum = counts.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_prob = np.where(counts > 0, np.log(counts) - np.log(_sum), -np.log(_sum) - power * math.log(2))
+            log_prior = np.log(_sum.ravel() / _total)
         _test_sets.append((x_test, y_test))
-        _prob_lst = []
-        for counter in _counters:
-            _sum = sum(counter.values())
-            _prob_lst.append({
-                key: value / _sum for key, value in counter.items()
-            })
-            _prob_lst[-1]["null"] = _sum * 2 ** power
-            _prob_lst[-1]["prior"] = _sum / _total
-        _prob_lists.append(_prob_lst)
-    return _test_sets, _prob_lists
-
-
-def test(test_sets, prob_lists):
+        _models.append((log_prob, log_prior))
+    return _test_sets, _models
+
+
+def test(test_sets, models):
     acc_lst = []
     for i in range(10):
-        _prob_lst = prob_lists[i]
         x_test, y_test = test_sets[i]
-        y_pred = np.array([pick_best(sentence, _prob_lst) for sentence in x_test])
-        y_test = np.array(y_test)
+        y_pred = pick_best(x_test, models[i])
         acc_lst.append(100 * np.sum(y_pred == y_test) / len(y_pred))
     return acc_lst
 
@@ -93,8 +101,7 @@ if __name__ == '__main__':
     acc_list = test(sets, lists)
     idx = np.argmax(acc_list)  # type: int
     lst_, (x_, y_) = lists[idx], sets[idx]
-    print(metrics.classification_report(y_, [
-        pick_best(sentence, lst_) for sentence in x_
-    ], target_names=np.load(os.path.join("_Data", "LABEL_DIC.npy"))))
+    print(metrics.classification_report(
+        y_, pick_best(x_, lst_), target_names=np.load(os.path.join("_Data", "LABEL_DIC.npy"))))
 
     print("Done")
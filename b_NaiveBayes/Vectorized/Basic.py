@@ -4,10 +4,12 @@ root_path = os.path.abspath("../../")
 if root_path not in sys.path:
     sys.path.append(root_path)
 
+import pickle
 import numpy as np
 from math import pi
 
 from Util.Timing import Timing
+from Util.Parallel import map_reduce
 from Util.Bases import ClassifierBase
 
 sqrt_pi = (2 * pi) ** 0.5
@@ -33,9 +35,92 @@ class NBFunctions:
 
         return [func(_c=c) for c in range(n_category)]
 
+    @staticmethod
+    def gaussian_function(mu, sigma):
+        def sub(x):
+            return NBFunctions.gaussian(x, mu, sigma)
+        return sub
+
+    @staticmethod
+    def pad_counter(counter, shape):
+        """ counter (None for an empty one) zero-padded to shape, to make room for new classes / categories """
+        rs = np.zeros(shape)
+        if counter is not None:
+            counter = np.asarray(counter, dtype=np.float64)
+            rs[tuple(slice(0, n) for n in counter.shape)] = counter
+        return rs
+
+    @staticmethod
+    def merge_moments(n_a, mu_a, m2_a, n_b, mu_b, m2_b):
+        """
+            Chan et al. parallel update of (count, mean, sum of squared deviations), row by row (class by class)
+            :return : (n, mu, m2) of the union of both sets of samples
+        """
+        n = n_a + n_b
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(n > 0, n_b / n, 0)[..., None]
+            cross = np.where(n > 0, n_a * n_b / n, 0)[..., None]
+        delta = mu_b - mu_a
+        return n, mu_a + delta * ratio, m2_a + m2_b + delta ** 2 * cross
+
+
+class NBStats:
+    """
+        Sufficient statistics of a naive Bayes model: what fitting needs, without any raw sample
+        Labels (& categories) are stored as arrays of values in code order, so statistics of different data
+          can be aligned; merge is associative (new values are appended in order of appearance), hence
+          statistics of shards may be computed independently (e.g. by a process pool) and reduced
+        Usage:
+            1) Stats.from_data(x, y, sample_weight) : statistics of one shard
+            2) stats.merge(other) (or stats + other) : statistics of both shards
+            3) stats.save(path) / Stats.load(path)   : persist with pickle
+    """
+
+    def __init__(self, labels):
+        self.labels = np.asarray(labels)
+
+    def __str__(self):
+        return "{}({} classes)".format(type(self).__name__, len(self.labels))
+
+    __repr__ = __str__
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    @staticmethod
+    def from_data(x, y, sample_weight=None):
+        pass
+
+    def merge(self, other):
+        pass
+
+    @staticmethod
+    def union(values, other_values):
+        """ values followed by the ones of other_values they miss, and the position of every other value in them """
+        other_values = np.asarray(other_values)
+        positions = np.full(len(other_values), -1, dtype=np.int64)
+        if len(values):
+            order = np.argsort(values, kind="mergesort")
+            indices = order[np.minimum(np.searchsorted(values[order], other_values), len(values) - 1)]
+            known = values[indices] == other_values
+            positions[known] = indices[known]
+        new = positions < 0
+        positions[new] = len(values) + np.arange(np.sum(new))
+        return np.concatenate([values, other_values[new]]), positions
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
 
 class NaiveBayes(ClassifierBase):
     NaiveBayesTiming = Timing()
+    stats_class = NBStats
 
     def __init__(self, **kwargs):
         super(NaiveBayes, self).__init__(**kwargs)
@@ -53,9 +138,50 @@ class NaiveBayes(ClassifierBase):
     def feed_sample_weight(self, sample_weight=None):
         pass
 
+    def get_stats(self):
+        """ Sufficient statistics (see NBStats) of the data fed so far """
+        pass
+
+    def set_stats(self, stats, lb=None):
+        """ Fit the model from sufficient statistics """
+        pass
+
+    def _check_stats_class(self):
+        if self.stats_class is NBStats:
+            raise NotImplementedError(
+                "{} does not define sufficient statistics (stats_class), use fit instead".format(type(self).__name__))
+
+    @property
+    def labels(self):
+        return np.array([self.label_dict[i] for i in range(len(self.label_dict))])
+
+    @NaiveBayesTiming.timeit(level=1, prefix="[API] ")
+    def partial_fit(self, x, y, sample_weight=None, lb=None):
+        """
+            Merge the statistics of one chunk of data into the current ones & refit, so that data larger than
+              memory can be fed chunk by chunk (classes & categories unseen so far are appended)
+            :param sample_weight : Weights of the samples of the chunk (counted as 1 if not provided)
+        """
+        self._check_stats_class()
+        stats = self.stats_class.from_data(x, y, sample_weight)
+        if self._cat_counter is not None:
+            stats = self.get_stats().merge(stats)
+        self.set_stats(stats, lb)
+
+    @NaiveBayesTiming.timeit(level=1, prefix="[API] ")
+    def fit_shards(self, shards, n_jobs=1, lb=None):
+        """
+            Map-reduce fit: statistics of every shard are computed by n_jobs processes, then merged
+            :param shards : (x, y) or (x, y, sample_weight) tuples, or callables returning them (so that every
+                              worker loads its own shard)
+            :param n_jobs : Number of processes (1: in this process, <= 0: all cores)
+        """
+        self._check_stats_class()
+        self.set_stats(map_reduce(self.stats_class.from_data, shards, n_jobs), lb)
+
     @NaiveBayesTiming.timeit(level=2, prefix="[API] ")
     def get_prior_probability(self, lb=1):
-        return [(c_num + lb) / (len(self._y) + lb * len(self._cat_counter))
+        return [(c_num + lb) / (np.sum(self._cat_counter) + lb * len(self._cat_counter))
                 for c_num in self._cat_counter]
 
     @NaiveBayesTiming.timeit(level=2, prefix="[API] ")
@@ -74,21 +200,36 @@ class NaiveBayes(ClassifierBase):
     def _func(self, x, i):
         pass
 
+    def _log_likelihood(self, x):
+        """ log P(x | c) of every (transferred) sample for every class, as a (n_samples, n_category) array """
+        pass
+
+    @NaiveBayesTiming.timeit(level=1, prefix="[Core] ")
+    def _log_joint(self, x):
+        with np.errstate(divide="ignore"):
+            return self._log_likelihood(x) + np.log(self._p_category)
+
+    @NaiveBayesTiming.timeit(level=1, prefix="[API] ")
+    def predict_log_proba(self, x):
+        log_joint = self._log_joint(self._transfer_x(x))
+        log_max = np.max(log_joint, axis=1, keepdims=True)
+        return log_joint - log_max - np.log(np.sum(np.exp(log_joint - log_max), axis=1, keepdims=True))
+
+    def predict_proba(self, x):
+        """ Posterior probabilities, columns follow label_dict """
+        return np.exp(self.predict_log_proba(x))
+
     @NaiveBayesTiming.timeit(level=1, prefix="[API] ")
     def predict(self, x, get_raw_result=False, **kwargs):
-        if isinstance(x, np.ndarray):
-            x = x.tolist()
-        else:
-            x = [xx[:] for xx in x]
-        x = self._transfer_x(x)
-        m_arg, m_probability = np.zeros(len(x), dtype=np.int8), np.zeros(len(x))
-        for i in range(len(self._cat_counter)):
-            p = self._func(x, i)
-            mask = p > m_probability
-            m_arg[mask], m_probability[mask] = i, p[mask]
+        """
+            Everything is computed in log space on coded ndarrays (see _transfer_x), for all classes at once
+            :return : Labels, or the (unnormalized) probability of the predicted class if get_raw_result
+        """
+        log_joint = self._log_joint(self._transfer_x(x))
+        m_arg = np.argmax(log_joint, axis=1)
         if not get_raw_result:
-            return np.array([self.label_dict[arg] for arg in m_arg])
-        return m_probability
+            return np.array([self.label_dict[i] for i in range(len(self.label_dict))])[m_arg]
+        return np.exp(log_joint[np.arange(len(m_arg)), m_arg])
 
     def _transfer_x(self, x):
-        return x
+        return np.atleast_2d(x)
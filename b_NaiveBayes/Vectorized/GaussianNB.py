@@ -11,8 +11,58 @@ from b_NaiveBayes.Vectorized.Basic import *
 from Util.Timing import Timing
 
 
+class GaussianStats(NBStats):
+    """
+        labels       : (n_category,) values of the classes
+        class_counts : (n_category,) (weighted) number of samples of every class
+        mu, m2       : (n_category, n_dim) means & sums of squared deviations of every class
+        Moments are merged with the parallel formulas of Chan et al.
+    """
+
+    def __init__(self, labels, class_counts, mu, m2):
+        super(GaussianStats, self).__init__(labels)
+        self.class_counts = np.asarray(class_counts, dtype=np.float64)
+        self.mu, self.m2 = np.asarray(mu, dtype=np.float64), np.asarray(m2, dtype=np.float64)
+
+    @staticmethod
+    def from_data(x, y, sample_weight=None):
+        labels, y = np.unique(y, return_inverse=True)
+        return GaussianStats.from_codes(x, y.ravel(), labels, sample_weight)
+
+    @staticmethod
+    def from_codes(x, y, labels, sample_weight=None):
+        """ Weighted moments of x, where y holds the codes (indices in labels) of the classes """
+        x = np.array(x, dtype=np.float64, ndmin=2)
+        weights = np.ones(len(y)) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        one_hot = (y[..., None] == np.arange(len(labels))) * weights[..., None]
+        class_counts = one_hot.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Classes whose weights are all 0 get mu = 0 (& m2 = 0)
+            mu = np.where(class_counts[..., None] > 0, one_hot.T.dot(x) / class_counts[..., None], 0)
+        return GaussianStats(labels, class_counts, mu, one_hot.T.dot((x - mu[y]) ** 2))
+
+    def merge(self, other):
+        labels, label_idx = NBStats.union(self.labels, other.labels)
+        shape = (len(labels), self.mu.shape[1])
+        other_counts, other_mu, other_m2 = np.zeros(len(labels)), np.zeros(shape), np.zeros(shape)
+        other_counts[label_idx], other_mu[label_idx], other_m2[label_idx] = other.class_counts, other.mu, other.m2
+        return GaussianStats(labels, *NBFunctions.merge_moments(
+            NBFunctions.pad_counter(self.class_counts, len(labels)), NBFunctions.pad_counter(self.mu, shape),
+            NBFunctions.pad_counter(self.m2, shape), other_counts, other_mu, other_m2))
+
+
 class GaussianNB(NaiveBayes):
+    """
+        Sample weights are used as frequencies (weighted class counts, means & variances), both by fit and by
+          partial_fit / fit_shards
+    """
+
     GaussianNBTiming = Timing()
+    stats_class = GaussianStats
+
+    def __init__(self, **kwargs):
+        super(GaussianNB, self).__init__(**kwargs)
+        self._mu = self._sigma = self._m2 = self._sample_weight = None
 
     @GaussianNBTiming.timeit(level=1, prefix="[API] ")
     def feed_data(self, x, y, sample_weight=None):
@@ -23,44 +73,62 @@ class GaussianNB(NaiveBayes):
         label_dict = {label: i for i, label in enumerate(labels)}
         y = np.array([label_dict[yy] for yy in y])
         cat_counter = np.bincount(y)
-        labels = [y == value for value in range(len(cat_counter))]
-        labelled_x = [x[label].T for label in labels]
 
         self._x, self._y = x.T, y
-        self._labelled_x, self._label_zip = labelled_x, labels
         self._cat_counter, self.label_dict = cat_counter, {i: l for l, i in label_dict.items()}
+        self._m2 = None
         self.feed_sample_weight(sample_weight)
 
     @GaussianNBTiming.timeit(level=1, prefix="[Core] ")
     def feed_sample_weight(self, sample_weight=None):
-        if sample_weight is not None:
-            local_weights = sample_weight * len(sample_weight)
-            for i, label in enumerate(self._label_zip):
-                self._labelled_x[i] *= local_weights[label]
+        self._sample_weight = None if sample_weight is None else sample_weight * len(sample_weight)
+
+    def get_stats(self):
+        if self._m2 is None:
+            self._fit(0)
+        return GaussianStats(self.labels, self._cat_counter, self._mu, self._m2)
+
+    @GaussianNBTiming.timeit(level=1, prefix="[API] ")
+    def set_stats(self, stats, lb=None):
+        self.label_dict = {i: label for i, label in enumerate(stats.labels)}
+        self._cat_counter, self._mu, self._m2 = stats.class_counts, stats.mu, stats.m2
+        counts = self._cat_counter[..., None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Classes without (weighted) samples have a 0 prior, sigma only has to keep their likelihood finite
+            self._sigma = np.where(counts > 0, self._m2 / counts, 1.)
+        self._p_category = self.get_prior_probability(0)
+        self._data = [
+            [NBFunctions.gaussian_function(mu, sigma) for mu, sigma in zip(self._mu[..., dim], self._sigma[..., dim])]
+            for dim in range(self._mu.shape[1])]
 
     @GaussianNBTiming.timeit(level=1, prefix="[Core] ")
     def _fit(self, lb):
-        lb = 0
-        n_category = len(self._cat_counter)
-        self._p_category = self.get_prior_probability(lb)
-        data = [
-            NBFunctions.gaussian_maximum_likelihood(
-                self._labelled_x, n_category, dim) for dim in range(len(self._x))]
-        self._data = data
+        self.set_stats(GaussianStats.from_codes(self._x.T, self._y, self.labels, self._sample_weight))
 
     @GaussianNBTiming.timeit(level=1, prefix="[Core] ")
-    def _func(self, x, i):
-        x = np.atleast_2d(x).T
-        rs = np.ones(x.shape[1])
-        for d, xx in enumerate(x):
-            rs *= self._data[d][i](xx)
-        return rs * self._p_category[i]
+    def _log_likelihood(self, x):
+        # sum_d (x_d - mu_d) ^ 2 / (2 * sigma_d ^ 2) for every class, expanded into matrix products
+        x = np.atleast_2d(x)
+        a = 0.5 / self._sigma ** 2
+        rs = (x ** 2).dot(a.T)
+        rs -= 2 * x.dot((self._mu * a).T)
+        rs += np.sum(self._mu ** 2 * a, axis=1)
+        rs += np.sum(np.log(sqrt_pi * self._sigma), axis=1)
+        return -rs
+
+    def _transfer_x(self, x):
+        return np.array(x, dtype=np.float64, ndmin=2)
 
     def visualize(self, save=False):
         colors = plt.cm.Paired([i / len(self.label_dict) for i in range(len(self.label_dict))])
         colors = {cat: color for cat, color in zip(self.label_dict.values(), colors)}
-        for j in range(len(self._x)):
-            tmp_data = self._x[j]
+        for j in range(self._mu.shape[1]):
+            if self._x is not None:
+                tmp_data = self._x[j]
+            else:
+                # Fitted from statistics only (partial_fit / fit_shards)
+                radius = 3 * self._sigma[..., j]
+                tmp_data = np.concatenate([self._mu[..., j] - radius, self._mu[..., j] + radius])
             x_min, x_max = np.min(tmp_data), np.max(tmp_data)
             gap = x_max - x_min
             tmp_x = np.linspace(x_min-0.1*gap, x_max+0.1*gap, 200)
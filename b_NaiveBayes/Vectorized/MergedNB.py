@@ -8,7 +8,7 @@ from b_NaiveBayes.Vectorized.Basic import *
 from b_NaiveBayes.Vectorized.MultinomialNB import MultinomialNB
 from b_NaiveBayes.Vectorized.GaussianNB import GaussianNB
 
-from Util.Util import DataUtil
+from Util.Util import DataUtil, CategoricalEncoder
 from Util.Timing import Timing
 
 
@@ -18,6 +18,7 @@ class MergedNB(NaiveBayes):
     def __init__(self, **kwargs):
         super(MergedNB, self).__init__(**kwargs)
         self._multinomial, self._gaussian = MultinomialNB(), GaussianNB()
+        self._encoder = None
 
         wc = kwargs.get("whether_continuous")
         if wc is None:
@@ -30,8 +31,9 @@ class MergedNB(NaiveBayes):
     def feed_data(self, x, y, sample_weight=None):
         if sample_weight is not None:
             sample_weight = np.asarray(sample_weight)
+        self._encoder = CategoricalEncoder(wc=self._whether_continuous)
         x, y, wc, features, feat_dicts, label_dict = DataUtil.quantize_data(
-            x, y, wc=self._whether_continuous, separate=True)
+            x, y, separate=True, encoder=self._encoder)
         if self._whether_continuous is None:
             self._whether_continuous = wc
             self._whether_discrete = ~self._whether_continuous
@@ -42,21 +44,16 @@ class MergedNB(NaiveBayes):
         cat_counter = np.bincount(y)
         self._cat_counter = cat_counter
 
-        labels = [y == value for value in range(len(cat_counter))]
-        labelled_x = [discrete_x[ci].T for ci in labels]
-
-        self._multinomial._x, self._multinomial._y = x, y
-        self._multinomial._labelled_x, self._multinomial._label_zip = labelled_x, list(zip(labels, labelled_x))
+        self._multinomial._x, self._multinomial._y = discrete_x, y
         self._multinomial._cat_counter = cat_counter
         self._multinomial._feat_dicts = [dic for i, dic in enumerate(feat_dicts) if self._whether_discrete[i]]
         self._multinomial._n_possibilities = [len(feats) for i, feats in enumerate(features)
                                               if self._whether_discrete[i]]
+        self._multinomial._encoder = CategoricalEncoder.from_feat_dicts(
+            [False] * len(self._multinomial._feat_dicts), self._multinomial._feat_dicts)
         self._multinomial.label_dict = label_dict
 
-        labelled_x = [continuous_x[label].T for label in labels]
-
         self._gaussian._x, self._gaussian._y = continuous_x.T, y
-        self._gaussian._labelled_x, self._gaussian._label_zip = labelled_x, labels
         self._gaussian._cat_counter, self._gaussian.label_dict = cat_counter, label_dict
 
         self.feed_sample_weight(sample_weight)
@@ -65,6 +62,7 @@ class MergedNB(NaiveBayes):
     def feed_sample_weight(self, sample_weight=None):
         self._multinomial.feed_sample_weight(sample_weight)
         self._gaussian.feed_sample_weight(sample_weight)
+        self._cat_counter = self._multinomial["cat_counter"]
 
     @MergedNBTiming.timeit(level=1, prefix="[Core] ")
     def _fit(self, lb):
@@ -73,25 +71,14 @@ class MergedNB(NaiveBayes):
         self._p_category = self._multinomial["p_category"]
 
     @MergedNBTiming.timeit(level=1, prefix="[Core] ")
-    def _func(self, x, i):
-        x = np.atleast_2d(x)
-        return self._multinomial["func"](
-            x[:, self._whether_discrete].astype(np.int), i) * self._gaussian["func"](
-            x[:, self._whether_continuous], i) / self._p_category[i]
+    def _log_likelihood(self, x):
+        discrete_x, continuous_x = x
+        return self._multinomial["log_likelihood"](discrete_x) + self._gaussian["log_likelihood"](continuous_x)
 
     @MergedNBTiming.timeit(level=1, prefix="[Core] ")
     def _transfer_x(self, x):
-        feat_dicts = self._multinomial["feat_dicts"]
-        idx = 0
-        for d, discrete in enumerate(self._whether_discrete):
-            for i, sample in enumerate(x):
-                if not discrete:
-                    x[i][d] = float(x[i][d])
-                else:
-                    x[i][d] = feat_dicts[idx][sample[d]]
-            if discrete:
-                idx += 1
-        return x
+        discrete_x, continuous_x = self._encoder.transform(x, separate=True)
+        return discrete_x, self._gaussian["transfer_x"](continuous_x)
 
 if __name__ == '__main__':
     import time
@@ -8,69 +8,139 @@ import matplotlib.pyplot as plt
 
 from b_NaiveBayes.Vectorized.Basic import *
 
-from Util.Util import DataUtil
+from Util.Util import DataUtil, CategoricalEncoder
 from Util.Timing import Timing
 
 
+class MultinomialStats(NBStats):
+    """
+        labels         : (n_category,) values of the classes
+        categories     : (n_possibilities_j,) values of every feature j
+        class_counts   : (n_category,) (weighted) number of samples of every class
+        feature_counts : (n_category, n_possibilities_j) (weighted) occurrences of every category of every feature j
+    """
+
+    def __init__(self, labels, categories, class_counts, feature_counts):
+        super(MultinomialStats, self).__init__(labels)
+        self.categories = [np.asarray(values) for values in categories]
+        self.class_counts = np.asarray(class_counts, dtype=np.float64)
+        self.feature_counts = [np.asarray(counts, dtype=np.float64) for counts in feature_counts]
+
+    @staticmethod
+    def from_data(x, y, sample_weight=None):
+        encoder = CategoricalEncoder(wc=np.array([False] * len(x[0])))
+        x = encoder.fit_transform(x)
+        labels, y = np.unique(y, return_inverse=True)
+        return MultinomialStats.from_codes(x, y.ravel(), labels, encoder.categories, sample_weight)
+
+    @staticmethod
+    def from_codes(x, y, labels, categories, sample_weight=None):
+        """ Weighted counts of x & y, which hold the codes (indices in categories & labels) of the samples """
+        n_category = len(labels)
+        if sample_weight is not None:
+            sample_weight = np.asarray(sample_weight, dtype=np.float64)
+        return MultinomialStats(labels, categories, np.bincount(y, sample_weight, minlength=n_category), [
+            np.bincount(y * len(values) + x[..., dim], sample_weight, minlength=n_category * len(values)).reshape(
+                n_category, len(values)) for dim, values in enumerate(categories)])
+
+    def merge(self, other):
+        labels, label_idx = NBStats.union(self.labels, other.labels)
+        class_counts = NBFunctions.pad_counter(self.class_counts, len(labels))
+        class_counts[label_idx] += other.class_counts
+        categories, feature_counts = [], []
+        for values, other_values, counts, other_counts in zip(
+                self.categories, other.categories, self.feature_counts, other.feature_counts):
+            values, idx = NBStats.union(values, other_values)
+            counts = NBFunctions.pad_counter(counts, (len(labels), len(values)))
+            counts[np.ix_(label_idx, idx)] += other_counts
+            categories.append(values)
+            feature_counts.append(counts)
+        return MultinomialStats(labels, categories, class_counts, feature_counts)
+
+
 class MultinomialNB(NaiveBayes):
+    """
+        Per feature log-likelihood tables of every class are stored side by side in one (n_rows, n_category)
+          array (self._log_table, one extra row per feature for unknown values), so that the log-likelihoods
+          of a batch are gathered with a single fancy index and summed over features
+        Samples are encoded column by column with the CategoricalEncoder fitted in feed_data
+        Sample weights are used as frequencies (weighted class counts & category counts), both by fit and by
+          partial_fit / fit_shards
+    """
+
     MultinomialNBTiming = Timing()
+    stats_class = MultinomialStats
+
+    def __init__(self, **kwargs):
+        super(MultinomialNB, self).__init__(**kwargs)
+        self._log_table = self._offsets = self._encoder = None
 
     @MultinomialNBTiming.timeit(level=1, prefix="[API] ")
     def feed_data(self, x, y, sample_weight=None):
         if sample_weight is not None:
             sample_weight = np.asarray(sample_weight)
-        x, y, _, features, feat_dicts, label_dict = DataUtil.quantize_data(x, y, wc=np.array([False] * len(x[0])))
-        cat_counter = np.bincount(y)
-        n_possibilities = [len(feats) for feats in features]
-
-        labels = [y == value for value in range(len(cat_counter))]
-        labelled_x = [x[ci].T for ci in labels]
-
+        self._encoder = CategoricalEncoder(wc=np.array([False] * len(x[0])))
+        x, y, _, features, feat_dicts, label_dict = DataUtil.quantize_data(x, y, encoder=self._encoder)
         self._x, self._y = x, y
-        self._labelled_x, self._label_zip = labelled_x, list(zip(labels, labelled_x))
-        self._cat_counter, self._feat_dicts, self._n_possibilities = cat_counter, feat_dicts, n_possibilities
+        self._feat_dicts, self._n_possibilities = feat_dicts, [len(feats) for feats in features]
         self.label_dict = label_dict
         self.feed_sample_weight(sample_weight)
 
     @MultinomialNBTiming.timeit(level=1, prefix="[Core] ")
     def feed_sample_weight(self, sample_weight=None):
-        self._con_counter = []
-        for dim, p in enumerate(self._n_possibilities):
-            if sample_weight is None:
-                self._con_counter.append([
-                    np.bincount(xx[dim], minlength=p) for xx in self._labelled_x])
-            else:
-                self._con_counter.append([
-                    np.bincount(xx[dim], weights=sample_weight[label] / sample_weight[label].mean(), minlength=p)
-                    for label, xx in self._label_zip])
+        if sample_weight is not None:
+            sample_weight = sample_weight * len(sample_weight)
+        stats = MultinomialStats.from_codes(self._x, self._y, self.labels, self._categories, sample_weight)
+        self._cat_counter, self._con_counter = stats.class_counts, stats.feature_counts
+
+    @property
+    def _categories(self):
+        return [np.array(sorted(feat_dict, key=feat_dict.get)) for feat_dict in self._feat_dicts]
+
+    def get_stats(self):
+        return MultinomialStats(self.labels, self._categories, self._cat_counter, self._con_counter)
+
+    @MultinomialNBTiming.timeit(level=1, prefix="[API] ")
+    def set_stats(self, stats, lb=None):
+        if lb is None:
+            lb = self._params["lb"]
+        self.label_dict = {i: label for i, label in enumerate(stats.labels)}
+        self._encoder = CategoricalEncoder.from_feat_dicts([False] * len(stats.categories), [
+            {value: i for i, value in enumerate(categories.tolist())} for categories in stats.categories])
+        self._feat_dicts = self._encoder.feat_dicts
+        self._n_possibilities = [len(categories) for categories in stats.categories]
+        self._cat_counter, self._con_counter = stats.class_counts, stats.feature_counts
+        self._fit(lb)
 
     @MultinomialNBTiming.timeit(level=1, prefix="[Core] ")
     def _fit(self, lb):
-        n_dim = len(self._n_possibilities)
-        n_category = len(self._cat_counter)
         self._p_category = self.get_prior_probability(lb)
-
-        data = [[] for _ in range(n_dim)]
-        for dim, n_possibilities in enumerate(self._n_possibilities):
-            data[dim] = [
-                [(self._con_counter[dim][c][p] + lb) / (self._cat_counter[c] + lb * n_possibilities)
-                 for p in range(n_possibilities)] for c in range(n_category)]
-        self._data = [np.asarray(dim_info) for dim_info in data]
+        cat_counter = np.asarray(self._cat_counter, dtype=np.float64)[..., None]
+        self._data = [
+            (np.asarray(self._con_counter[dim]) + lb) / (cat_counter + lb * n_possibilities)
+            for dim, n_possibilities in enumerate(self._n_possibilities)]
+        # Unknown values get the smoothed probability of an unseen value (ignored if lb == 0)
+        unknown = [
+            lb / (cat_counter + lb * n_possibilities) if lb > 0 else np.ones_like(cat_counter)
+            for n_possibilities in self._n_possibilities]
+        with np.errstate(divide="ignore"):
+            self._log_table = np.log(np.hstack([
+                table for data, unknown_p in zip(self._data, unknown) for table in (data, unknown_p)])).T
+        self._offsets = np.cumsum([0] + [n_possibilities + 1 for n_possibilities in self._n_possibilities[:-1]])
 
     @MultinomialNBTiming.timeit(level=1, prefix="[Core] ")
-    def _func(self, x, i):
-        x = np.atleast_2d(x).T
-        rs = np.ones(x.shape[1])
-        for d, xx in enumerate(x):
-            rs *= self._data[d][i][xx]
-        return rs * self._p_category[i]
+    def _log_likelihood(self, x, chunk_size=2 ** 22):
+        x = np.atleast_2d(x)
+        codes = np.where(x < 0, np.asarray(self._n_possibilities), x) + self._offsets
+        rs = np.empty((len(x), self._log_table.shape[1]))
+        chunk = max(1, chunk_size // max(1, codes.shape[1] * self._log_table.shape[1]))
+        for start in range(0, len(x), chunk):
+            rs[start:start + chunk] = self._log_table[codes[start:start + chunk]].sum(axis=1)
+        return rs
 
     @MultinomialNBTiming.timeit(level=1, prefix="[Core] ")
     def _transfer_x(self, x):
-        for i, sample in enumerate(x):
-            for j, char in enumerate(sample):
-                x[i][j] = self._feat_dicts[j][char]
-        return x
+        return self._encoder.transform(x)
 
     def visualize(self, save=False):
         colors = plt.cm.Paired([i / len(self.label_dict) for i in range(len(self.label_dict))])
@@ -0,0 +1,105 @@
+import os
+import sys
+root_path = os.path.abspath("../../")
+if root_path not in sys.path:
+    sys.path.append(root_path)
+
+import unittest
+import numpy as np
+from functools import partial
+
+from b_NaiveBayes.Vectorized.MultinomialNB import MultinomialNB
+from b_NaiveBayes.Vectorized.GaussianNB import GaussianNB
+from b_NaiveBayes.Vectorized.MergedNB import MergedNB
+
+from Util.Util import DataUtil
+
+np.random.seed(142857)
+(x_discrete, y_discrete), _ = DataUtil.get_dataset(
+    "mushroom", "../../_Data/mushroom.txt", n_train=1000, tar_idx=0)
+x_discrete, y_discrete = np.array(x_discrete), np.array(y_discrete)
+x_continuous = np.random.randn(1000, 3)
+y_continuous = np.where(x_continuous[..., 0] + 0.5 * np.random.randn(1000) > 0, "a", "b")
+weights = np.random.random(1000)
+cases = ((MultinomialNB, x_discrete, y_discrete), (GaussianNB, x_continuous, y_continuous))
+
+
+def load_shard(x, y, start, end):
+    return x[start:end], y[start:end]
+
+
+def check_same_model(case, model, other, x):
+    # Columns follow the label order of each model
+    order, other_order = np.argsort(model.labels), np.argsort(other.labels)
+    case.assertTrue(np.array_equal(model.labels[order], other.labels[other_order]), "Labels differ")
+    case.assertTrue(np.allclose(
+        np.asarray(model["cat_counter"])[order], np.asarray(other["cat_counter"])[other_order]
+    ), "Class counts differ")
+    case.assertTrue(np.allclose(
+        model.predict_proba(x)[..., order], other.predict_proba(x)[..., other_order]
+    ), "Probabilities differ")
+    case.assertTrue(np.array_equal(model.predict(x), other.predict(x)), "Predictions differ")
+
+
+class TestPartialFit(unittest.TestCase):
+    def test_00_unweighted(self):
+        for nb, x, y in cases:
+            model, other = nb(), nb()
+            model.fit(x, y)
+            for i in range(0, len(x), 300):
+                other.partial_fit(x[i:i + 300], y[i:i + 300])
+            check_same_model(self, model, other, x)
+
+    def test_01_weighted(self):
+        # fit treats sample weights as a distribution (scaled by n), partial_fit as frequencies
+        for nb, x, y in cases:
+            model, other = nb(), nb()
+            model.fit(x, y, sample_weight=weights / weights.sum())
+            scaled = weights * len(weights) / weights.sum()
+            for i in range(0, len(x), 300):
+                other.partial_fit(x[i:i + 300], y[i:i + 300], scaled[i:i + 300])
+            check_same_model(self, model, other, x)
+
+    def test_02_fit_then_partial_fit(self):
+        for nb, x, y in cases:
+            model, other = nb(), nb()
+            model.partial_fit(x, y, weights)
+            other.fit(x[:500], y[:500], sample_weight=weights[:500] / 500)
+            other.partial_fit(x[500:], y[500:], weights[500:])
+            check_same_model(self, model, other, x)
+
+    def test_03_no_stats(self):
+        with self.assertRaises(NotImplementedError):
+            MergedNB().partial_fit(x_discrete, y_discrete)
+
+
+class TestShards(unittest.TestCase):
+    def test_00_fit_shards(self):
+        for nb, x, y in cases:
+            model = nb()
+            model.fit(x, y)
+            shards = [(x[i:i + 300], y[i:i + 300]) for i in range(0, len(x), 300)]
+            for n_jobs in (1, 2):
+                other = nb()
+                other.fit_shards(shards, n_jobs=n_jobs)
+                check_same_model(self, model, other, x)
+
+    def test_01_lazy_shards(self):
+        for nb, x, y in cases:
+            model = nb()
+            model.fit(x, y)
+            other = nb()
+            other.fit_shards([partial(load_shard, x, y, i, i + 300) for i in range(0, len(x), 300)], n_jobs=2)
+            check_same_model(self, model, other, x)
+
+    def test_02_merge(self):
+        for nb, x, y in cases:
+            stats = [nb.stats_class.from_data(x[i:i + 250], y[i:i + 250]) for i in range(0, len(x), 250)]
+            model, other = nb(), nb()
+            model.set_stats((stats[0] + stats[1]) + (stats[2] + stats[3]))
+            other.set_stats(stats[3] + (stats[2] + (stats[1] + stats[0])))
+            check_same_model(self, model, other, x)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -128,3 +128,80 @@ class Cluster(metaclass=TimingMeta):
         else:
             raise NotImplementedError("Info_gain criterion '{}' not defined".format(criterion))
         return (gain, chaos_lst) if get_chaos_lst else gain
+
+    def _bin_chaos(self, counters, criterion, eps=1e-12):
+        # Row-wise chaos of (n_candidates, n_classes) class counters, matches ent() / gini() of sub clusters
+        totals = np.sum(counters, axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            p = counters / totals
+            if criterion == "ent":
+                chaos = -np.sum(np.where(p > 0, p * np.log(p), 0), axis=1) / math.log(self._base)
+                return np.maximum(eps, chaos)
+            chaos = 1 - np.sum(p ** 2, axis=1)
+        chaos[totals[..., 0] == 0] = 1
+        return chaos
+
+    def _best_bin_split(self, tars, left_len, left, total, criterion, eps):
+        # Score candidate thresholds from the (weighted) class counters of their left sides
+        if criterion not in ("ent", "ratio", "gini"):
+            raise NotImplementedError("Info_gain criterion '{}' not defined".format(criterion))
+        n = len(self._y)
+        if len(tars) == 0:
+            return 0, None, []
+        sub_criterion = "gini" if criterion == "gini" else "ent"
+        left_chaos = self._bin_chaos(left, sub_criterion, eps)
+        right_chaos = self._bin_chaos(total - left, sub_criterion, eps)
+        con_chaos = left_len / n * left_chaos + (n - left_len) / n * right_chaos
+        if criterion == "gini":
+            gains = self.gini() - con_chaos
+        else:
+            gains = self.ent() - con_chaos
+        # Thresholds which do not split samples (duplicated values) gain nothing
+        gains[(left_len == 0) | (left_len == n)] = 0
+        if criterion == "ratio":
+            split_counters = np.vstack([left_len, n - left_len]).T.astype(np.float64)
+            gains = gains / self._bin_chaos(split_counters, "ent", eps)
+        best = int(np.argmax(gains))
+        return gains[best], tars[best], [left_chaos[best], right_chaos[best]]
+
+    def bin_info_gain_scan(self, idx, criterion="gini", order=None, eps=1e-12):
+        """
+            Best continuous split of feature idx, evaluating every candidate threshold at once
+            Candidates are the mid points of sorted samples (as in CvDNode.fit). With samples sorted,
+              class counters of each side are prefix sums, so the whole scan is O(n log n) instead of
+              building two sub clusters per candidate
+            :param order: Pre-computed argsort of self._x[idx] (optional)
+            :return: (gain, threshold, chaos_lst) of the first best candidate, (0, None, []) if none
+        """
+        data = self._x[idx].astype(np.float64)
+        if order is None:
+            order = np.argsort(data, kind="mergesort")
+        samples, n = data[order], len(data)
+        tars = (samples[:-1] + samples[1:]) * 0.5
+        left_len = np.searchsorted(samples, tars)
+        weights = np.ones(n) if self._sample_weight is None else self._sample_weight[order]
+        cum = np.zeros((n + 1, len(self._counters)))
+        cum[np.arange(1, n + 1), self._y[order]] = weights
+        cum = np.cumsum(cum, axis=0)
+        return self._best_bin_split(tars, left_len, cum[left_len], cum[-1], criterion, eps)
+
+    def bin_info_gain_hist(self, idx, codes, n_bins, criterion="gini", eps=1e-12):
+        """
+            Best continuous split of feature idx among pre-computed bins (histogram mode)
+            Candidates lie between adjacent occupied bins, at the mid point of the closest samples on both
+              sides, so when every bin holds a single value they are the mid points of bin_info_gain_scan
+            :param codes : Bin index of each sample, bins are ordered by value
+            :param n_bins: Number of bins
+            :return: (gain, threshold, chaos_lst) of the first best candidate, (0, None, []) if none
+        """
+        data, n_class = self._x[idx].astype(np.float64), len(self._counters)
+        weights = np.ones(len(codes)) if self._sample_weight is None else self._sample_weight
+        hist = np.bincount(codes * n_class + self._y, weights, n_bins * n_class).reshape(n_bins, n_class)
+        occupied = np.flatnonzero(np.bincount(codes, minlength=n_bins))
+        lower, upper = np.full(n_bins, np.inf), np.full(n_bins, -np.inf)
+        np.minimum.at(lower, codes, data)
+        np.maximum.at(upper, codes, data)
+        tars = (upper[occupied[:-1]] + lower[occupied[1:]]) * 0.5
+        cum = np.cumsum(hist[occupied], axis=0)
+        cum_len = np.cumsum(np.bincount(codes, minlength=n_bins)[occupied])
+        return self._best_bin_split(tars, cum_len[:-1], cum[:-1], cum[-1], criterion, eps)
@@ -0,0 +1,190 @@
+import os
+import sys
+root_path = os.path.abspath("../")
+if root_path not in sys.path:
+    sys.path.append(root_path)
+
+import numpy as np
+
+
+class CompiledTree:
+    """
+        Array-backed (flattened) version of a fitted CvDTree, used for vectorized inference
+        Nodes are stored in breadth-first order as parallel arrays:
+            1) feature   : split feature of each node (-1 for leafs)
+            2) kind      : LEAF / CONTINUOUS (x < threshold) / BINARY (x == category) / MULTIWAY (ID3 & C4.5)
+            3) threshold : threshold of continuous splits, or category code of binary (Cart) splits
+            4) left      : left child (condition holds), -1 if none
+            5) right     : right child, -1 if none
+            6) classes   : leaf class; for inner nodes, the class used when a category is missing
+            7) table     : row of the multiway lookup table (-1 if the node is not multiway)
+        distributions[node] holds the class frequencies of the training samples which reached the node
+          (columns follow y_transformer), used for soft predictions; parent, n_samples and impurity
+          (chaos of the node) are kept for impurity based feature importances
+        Categorical features are encoded with per feature vocabularies (codes are indices in the
+          sorted vocabulary, -1 for unknown categories), so that lookup[table[node], code] gives
+          the child of a multiway node (-1 if the category is missing)
+        Samples are evaluated all at once, one tree level per step
+    """
+
+    LEAF, CONTINUOUS, BINARY, MULTIWAY = 0, 1, 2, 3
+
+    def __init__(self, tree):
+        self.y_transformer = tree.y_transformer
+        nodes, parents = self.flatten(tree.root)
+        indices = {id(node): i for i, node in enumerate(nodes)}
+        n_nodes = len(nodes)
+
+        self.feature = np.full(n_nodes, -1, dtype=np.int64)
+        self.kind = np.full(n_nodes, CompiledTree.LEAF, dtype=np.int8)
+        self.threshold = np.zeros(n_nodes)
+        self.left = np.full(n_nodes, -1, dtype=np.int64)
+        self.right = np.full(n_nodes, -1, dtype=np.int64)
+        self.classes = np.zeros(n_nodes, dtype=np.int64)
+        self.table = np.full(n_nodes, -1, dtype=np.int64)
+        self.distributions = np.zeros((n_nodes, len(self.y_transformer)))
+        self.parent = np.array([-1 if parent is None else parent for parent in parents], dtype=np.int64)
+        self.n_samples = np.array([0 if node["y"] is None else len(node["y"]) for node in nodes])
+        self.impurity = np.array([0 if node.chaos is None else node.chaos for node in nodes], dtype=np.float64)
+
+        categories = {}
+        for node in nodes:
+            if node.category is not None or node.feature_dim is None:
+                continue
+            if node.is_continuous:
+                continue
+            local_categories = categories.setdefault(node.feature_dim, set())
+            if node.is_cart:
+                local_categories.add(node.tar)
+            else:
+                local_categories.update(node.children.keys())
+        self.vocabs = {feat: np.array(sorted(values)) for feat, values in categories.items()}
+
+        tables = []
+        for i, (node, parent) in enumerate(zip(nodes, parents)):
+            if node["y"] is None or len(node["y"]) == 0:
+                self.distributions[i] = self.distributions[parent]
+            else:
+                counts = np.bincount(node["y"], minlength=len(self.y_transformer))
+                self.distributions[i] = counts / len(node["y"])
+            if node.category is not None:
+                self.classes[i] = node.category
+            elif node.feature_dim is None:
+                # Child which received no samples during training, fall back to its parent
+                self.classes[i] = self.classes[parent]
+                continue
+            else:
+                self.classes[i] = node.get_category()
+            if node.category is not None:
+                continue
+            self.feature[i] = node.feature_dim
+            if node.is_continuous:
+                self.kind[i] = CompiledTree.CONTINUOUS
+                self.threshold[i] = node.tar
+            elif node.is_cart:
+                self.kind[i] = CompiledTree.BINARY
+                self.threshold[i] = self._encode_column(np.array([node.tar]), node.feature_dim)[0]
+            else:
+                self.kind[i] = CompiledTree.MULTIWAY
+                self.table[i] = len(tables)
+                tables.append(node.children)
+            if self.kind[i] != CompiledTree.MULTIWAY:
+                if node.left_child is not None:
+                    self.left[i] = indices[id(node.left_child)]
+                if node.right_child is not None:
+                    self.right[i] = indices[id(node.right_child)]
+
+        width = max([len(vocab) for vocab in self.vocabs.values()], default=0)
+        self.lookup = np.full((len(tables), width), -1, dtype=np.int64)
+        for i in np.flatnonzero(self.kind == CompiledTree.MULTIWAY):
+            children = tables[self.table[i]]
+            codes = self._encode_column(np.array(list(children.keys())), self.feature[i])
+            self.lookup[self.table[i], codes] = [indices[id(child)] for child in children.values()]
+
+    def __str__(self):
+        return "CompiledTree ({} nodes)".format(len(self.kind))
+
+    __repr__ = __str__
+
+    @staticmethod
+    def _get_children(node):
+        if node.is_cart or node.is_continuous:
+            return [node.left_child, node.right_child]
+        return list(node.children.values())
+
+    @staticmethod
+    def flatten(root):
+        """ Nodes under root in breadth-first (compiled) order, with the index of their parents """
+        nodes, parents, cursor = [root], [None], 0
+        while cursor < len(nodes):
+            node = nodes[cursor]
+            if node.category is None and node.feature_dim is not None:
+                for child in CompiledTree._get_children(node):
+                    if child is not None:
+                        nodes.append(child)
+                        parents.append(cursor)
+            cursor += 1
+        return nodes, parents
+
+    def _encode_column(self, column, feat):
+        vocab = self.vocabs[feat]
+        idx = np.minimum(np.searchsorted(vocab, column), len(vocab) - 1)
+        return np.where(vocab[idx] == column, idx, -1)
+
+    def encode(self, x):
+        x = np.atleast_2d(x)
+        codes = np.zeros(x.shape)
+        for feat in np.unique(self.feature[self.feature >= 0]):
+            if feat in self.vocabs:
+                codes[..., feat] = self._encode_column(x[..., feat], feat)
+            else:
+                codes[..., feat] = x[..., feat].astype(np.float64)
+        return codes
+
+    def advance(self, codes, rows, current):
+        """ Child reached by samples codes[rows] from their current inner nodes, -1 where they stop """
+        kind, values = self.kind[current], codes[rows, self.feature[current]]
+        go_left = np.where(
+            kind == CompiledTree.CONTINUOUS,
+            values < self.threshold[current], values == self.threshold[current]
+        )
+        targets = np.where(go_left, self.left[current], self.right[current])
+        multiway = kind == CompiledTree.MULTIWAY
+        if np.any(multiway):
+            local_values = values[multiway].astype(np.int64)
+            targets[multiway] = np.where(
+                local_values >= 0, self.lookup[self.table[current[multiway]], local_values], -1
+            )
+        return targets
+
+    def apply(self, x):
+        """ Return the index of the node at which each sample stops """
+        codes = self.encode(x)
+        nodes = np.zeros(len(codes), dtype=np.int64)
+        active = np.flatnonzero(self.kind[nodes] != CompiledTree.LEAF)
+        while len(active):
+            targets = self.advance(codes, active, nodes[active])
+            moved = targets >= 0
+            nodes[active[moved]] = targets[moved]
+            active = active[moved]
+            active = active[self.kind[nodes[active]] != CompiledTree.LEAF]
+        return nodes
+
+    def predict_classes(self, x):
+        return self.classes[self.apply(x)]
+
+    def predict_proba(self, x):
+        return self.distributions[self.apply(x)]
+
+    def feature_importances(self, n_features):
+        """ Impurity decrease (weighted by samples) of the splits on each feature, normalized to sum 1 """
+        weighted = self.n_samples * self.impurity
+        decrease = weighted.copy()
+        np.subtract.at(decrease, self.parent[1:], weighted[1:])
+        inner = self.kind != CompiledTree.LEAF
+        rs = np.bincount(self.feature[inner], weights=decrease[inner], minlength=n_features)
+        total = np.sum(rs)
+        return rs / total if total > 0 else rs
+
+    def predict(self, x, get_raw_results=False, **kwargs):
+        return self.y_transformer[self.predict_classes(x)]
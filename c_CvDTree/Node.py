@@ -22,6 +22,9 @@ class CvDNode(metaclass=TimingMeta):
         self._children, self.leafs = {}, {}
         self.sample_weight = None
         self.wc = None
+        # Rows (of the training set of the tree) held by this node, and their sorted lists per
+        #   continuous feature ("presort" split method)
+        self.indices = self.sorted_indices = None
 
         self.tree = tree
         if tree is not None:
@@ -93,6 +96,7 @@ class CvDNode(metaclass=TimingMeta):
 
     def _handle_terminate(self):
         self.category = self.get_category()
+        self.sorted_indices = None
         parent = self.parent
         while parent is not None:
             parent.leafs[id(self)] = self.info_dict
@@ -142,21 +146,17 @@ class CvDNode(metaclass=TimingMeta):
         else:
             indices = np.random.permutation(feat_len)[:feature_bound]
         tmp_feats = [self.feats[i] for i in indices]
-        xt, feat_sets = self._x.T, self.tree.feature_sets
+        feat_sets = self.tree.feature_sets
         bin_ig, ig = cluster.bin_info_gain, cluster.info_gain
         for feat in tmp_feats:
             if self.wc[feat]:
-                samples = np.sort(xt[feat])
-                feat_set = (samples[:-1] + samples[1:]) * 0.5
-            else:
-                if self.is_cart:
-                    feat_set = feat_sets[feat]
-                else:
-                    feat_set = None
-            if self.is_cart or self.wc[feat]:
-                for tar in feat_set:
+                tmp_gain, tmp_tar, tmp_chaos_lst = self._scan_continuous(cluster, feat)
+                if tmp_gain > max_gain:
+                    (max_gain, chaos_lst), max_feature, max_tar = (tmp_gain, tmp_chaos_lst), feat, tmp_tar
+            elif self.is_cart:
+                for tar in feat_sets[feat]:
                     tmp_gain, tmp_chaos_lst = bin_ig(
-                        feat, tar, criterion=self.criterion, get_chaos_lst=True, continuous=self.wc[feat])
+                        feat, tar, criterion=self.criterion, get_chaos_lst=True)
                     if tmp_gain > max_gain:
                         (max_gain, chaos_lst), max_feature, max_tar = (tmp_gain, tmp_chaos_lst), feat, tar
             else:
@@ -177,6 +177,30 @@ class CvDNode(metaclass=TimingMeta):
         else:
             self._gen_children(chaos_lst, feature_bound)
 
+    def _scan_continuous(self, cluster, feat):
+        split_method = self.tree.split_method
+        if split_method == "presort":
+            positions = self.tree.positions
+            positions[self.indices] = np.arange(len(self.indices))
+            return cluster.bin_info_gain_scan(
+                feat, criterion=self.criterion, order=positions[self.sorted_indices[feat]])
+        if split_method == "hist":
+            codes, edges = self.tree.bins[feat]
+            return cluster.bin_info_gain_hist(feat, codes[self.indices], len(edges) + 1, criterion=self.criterion)
+        return cluster.bin_info_gain_scan(feat, criterion=self.criterion)
+
+    def _feed_partition(self, node, feat_mask):
+        if self.indices is None:
+            return
+        node.indices = self.indices[feat_mask]
+        if self.sorted_indices is not None:
+            members = self.tree.members
+            members[node.indices] = True
+            node.sorted_indices = {
+                feat: indices[members[indices]] for feat, indices in self.sorted_indices.items()
+            }
+            members[node.indices] = False
+
     def _gen_children(self, chaos_lst, feature_bound):
         feat, tar = self.feature_dim, self.tar
         self.is_continuous = continuous = self.wc[feat]
@@ -210,6 +234,7 @@ class CvDNode(metaclass=TimingMeta):
                 if len(tmp_labels) == 0:
                     continue
                 node.feats = new_feats
+                self._feed_partition(node, feat_mask)
                 node.fit(tmp_data, tmp_labels, local_weights, feature_bound)
         else:
             new_feats.remove(self.feature_dim)
@@ -223,12 +248,14 @@ class CvDNode(metaclass=TimingMeta):
                     depth=self._depth + 1, parent=self, is_root=False, prev_feat=feat)
                 new_node.feats = new_feats
                 self.children[feat] = new_node
+                self._feed_partition(new_node, feat_mask)
                 if self.sample_weight is None:
                     local_weights = None
                 else:
                     local_weights = self.sample_weight[feat_mask]
                     local_weights /= np.sum(local_weights)
                 new_node.fit(tmp_x, self._y[feat_mask], local_weights, feature_bound)
+        self.sorted_indices = None
 
     # Util
 
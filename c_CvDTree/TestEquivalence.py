@@ -0,0 +1,85 @@
+import os
+import sys
+root_path = os.path.abspath("../")
+if root_path not in sys.path:
+    sys.path.append(root_path)
+
+import unittest
+import numpy as np
+
+from c_CvDTree.Tree import ID3Tree, C45Tree, CartTree
+
+from Util.Util import DataUtil
+
+np.random.seed(142857)
+(x_train, y_train), (x_test, y_test) = DataUtil.get_dataset(
+    "mushroom", "../_Data/mushroom.txt", n_train=1000, tar_idx=0)
+x_train, x_test = np.array(x_train), np.array(x_test)
+x_spiral, y_spiral = DataUtil.gen_spiral(50, 4, 3, 2, one_hot=False)
+
+
+def predict_one_by_one(tree, x):
+    return np.array([tree.predict_one(xx) for xx in x])
+
+
+class TestCompiled(unittest.TestCase):
+    def _check(self, tree, x):
+        self.assertIsNotNone(tree.compiled, "Tree is not compiled after fit")
+        self.assertTrue(np.array_equal(tree.predict(x), predict_one_by_one(tree, x)),
+                        "Compiled predictions differ from predict_one")
+
+    def test_00_categorical(self):
+        for tree in (ID3Tree(), C45Tree(), CartTree()):
+            tree.fit(x_train, y_train)
+            self._check(tree, x_test)
+
+    def test_01_unknown_categories(self):
+        tree = ID3Tree()
+        tree.fit(x_train, y_train, train_only=True)
+        x = x_test.copy()
+        x[::3, :] = "unknown"
+        self._check(tree, x)
+
+    def test_02_continuous(self):
+        for tree in (C45Tree(), CartTree()):
+            tree.fit(x_spiral, y_spiral, train_only=True)
+            self._check(tree, x_spiral)
+
+
+class TestSplitMethods(unittest.TestCase):
+    @staticmethod
+    def _grow(x, y, split_method, sample_weight=None, tree=CartTree, seed=0):
+        np.random.seed(seed)
+        tree = tree(whether_continuous=[True] * x.shape[1], split_method=split_method)
+        tree.fit(x, y, sample_weight)
+        return tree
+
+    @staticmethod
+    def _structure(tree):
+        return [(node.feature_dim, node.tar, node.category) for node in tree.nodes]
+
+    def _check(self, x, y, split_method, sample_weight=None, tree=CartTree):
+        for seed in range(4):
+            exact = self._grow(x, y, "exact", sample_weight, tree, seed)
+            other = self._grow(x, y, split_method, sample_weight, tree, seed)
+            self.assertEqual(self._structure(exact), self._structure(other),
+                             "'{}' grows a different tree than 'exact'".format(split_method))
+            self.assertTrue(np.array_equal(exact.predict(x), other.predict(x)))
+
+    def test_00_presort(self):
+        x = np.random.RandomState(0).randn(400, 4)
+        y = ((x[..., 0] * x[..., 1] > 0) ^ (x[..., 2] > 1)).astype(int)
+        self._check(x, y, "presort")
+        self._check(x, y, "presort", np.full(len(x), 1 / len(x)))
+        self._check(x_spiral, y_spiral, "presort", tree=C45Tree)
+
+    def test_01_hist_few_values(self):
+        # Columns with at most max_bins distinct values split as in "exact"
+        x = np.round(np.random.RandomState(1).randn(400, 4), 1)
+        y = ((x[..., 0] * x[..., 1] > 0) ^ (x[..., 2] > 1)).astype(int)
+        self._check(x, y, "hist")
+        self._check(x, y, "hist", np.random.RandomState(2).rand(len(x)) / len(x))
+
+
+if __name__ == '__main__':
+    unittest.main()
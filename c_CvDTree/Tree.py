@@ -8,13 +8,18 @@ import cv2
 from copy import deepcopy
 
 from c_CvDTree.Node import *
+from c_CvDTree.Compiled import CompiledTree
 
 from Util.Timing import Timing
+from Util.Parallel import WorkerPool
 from Util.Bases import ClassifierBase
+from Util.Util import CategoricalEncoder
 
 
 def cvd_task(args):
     x, clf, n_cores = args
+    if clf.compiled is not None:
+        return clf.compiled.predict_classes(x)
     return np.array([clf.root.predict_one(xx) for xx in x])
 
 
@@ -23,10 +28,13 @@ class CvDBase(ClassifierBase):
 
     def __init__(self, whether_continuous=None, max_depth=None, node=None, **kwargs):
         super(CvDBase, self).__init__(**kwargs)
-        self.nodes, self.layers, self.roots = [], [], []
+        self.nodes, self.layers, self.prune_path = [], [], []
         self.max_depth = max_depth
         self.root = node
+        self.compiled = None
         self.feature_sets = []
+        self.split_method = None
+        self.sorted_indices = self.bins = self.positions = self.members = None
         self.prune_alpha = 1
         self.y_transformer = None
         self.whether_continuous = whether_continuous
@@ -36,24 +44,57 @@ class CvDBase(ClassifierBase):
         self._params["cv_rate"] = kwargs.get("cv_rate", 0.2)
         self._params["train_only"] = kwargs.get("train_only", False)
         self._params["feature_bound"] = kwargs.get("feature_bound", None)
+        self._params["split_method"] = kwargs.get("split_method", "exact")
+        self._params["max_bins"] = kwargs.get("max_bins", 256)
 
     def feed_data(self, x, continuous_rate=0.2):
-        xt = x.T
-        self.feature_sets = [set(dimension) for dimension in xt]
-        data_len, data_dim = x.shape
-        if self.whether_continuous is None:
-            self.whether_continuous = np.array(
-                [len(feat) >= int(continuous_rate * data_len) for feat in self.feature_sets])
-        else:
-            self.whether_continuous = np.asarray(self.whether_continuous)
+        encoder = CategoricalEncoder(self.whether_continuous, continuous_rate).fit(x)
+        self.feature_sets = [set(values) for values in encoder.uniques]
+        self.whether_continuous = encoder.wc
         self.root.feats = [i for i in range(x.shape[1])]
         self.root.feed_tree(self)
 
+    def _prepare_split(self, x, split_method, max_bins):
+        """
+            Pre-process continuous columns once so that nodes never re-sort them
+                1) "exact"   : every node sorts its own samples (mid points of all sorted samples)
+                2) "presort" : columns are argsorted once; sorted row lists are partitioned down the tree
+                3) "hist"    : columns are quantile-binned into at most max_bins buckets; nodes only
+                               accumulate per-bin class counters and split between their occupied bins
+                               (so columns with at most max_bins distinct values split as in "exact")
+        """
+        if split_method not in ("exact", "presort", "hist"):
+            raise NotImplementedError("Split method '{}' not defined".format(split_method))
+        self.split_method = split_method
+        self.sorted_indices = self.bins = self.positions = self.members = None
+        self.root.indices = np.arange(len(x))
+        continuous = [feat for feat in range(x.shape[1]) if self.whether_continuous[feat]]
+        if split_method == "exact" or not continuous:
+            return
+        self.positions = np.empty(len(x), dtype=np.int64)
+        if split_method == "presort":
+            # Membership mask shared by all nodes; each partition only sets & clears its own samples
+            self.members = np.zeros(len(x), dtype=np.bool_)
+            self.sorted_indices = {
+                feat: np.argsort(x[..., feat].astype(np.float64), kind="mergesort") for feat in continuous
+            }
+            self.root.sorted_indices = self.sorted_indices
+            return
+        self.bins = {}
+        for feat in continuous:
+            column = x[..., feat].astype(np.float64)
+            values = np.unique(column)
+            if len(values) <= max_bins:
+                edges = (values[:-1] + values[1:]) * 0.5
+            else:
+                edges = np.unique(np.percentile(column, np.linspace(0, 100, max_bins + 1)[1:-1]))
+            self.bins[feat] = (np.searchsorted(edges, column, side="right"), edges)
+
     # Grow
 
     @CvDBaseTiming.timeit(level=1, prefix="[API] ")
     def fit(self, x, y, sample_weight=None, alpha=None, eps=None,
-            cv_rate=None, train_only=None, feature_bound=None):
+            cv_rate=None, train_only=None, feature_bound=None, split_method=None, max_bins=None):
         if sample_weight is None:
             sample_weight = self._params["sample_weight"]
         if alpha is None:
@@ -66,6 +107,11 @@ class CvDBase(ClassifierBase):
             train_only = self._params["train_only"]
         if feature_bound is None:
             feature_bound = self._params["feature_bound"]
+        if split_method is None:
+            split_method = self._params["split_method"]
+        if max_bins is None:
+            max_bins = self._params["max_bins"]
+        WorkerPool.release(self)
         self.y_transformer, y = np.unique(y, return_inverse=True)
         x = np.atleast_2d(x)
         self.prune_alpha = alpha if alpha is not None else x.shape[1] / 2
@@ -86,9 +132,12 @@ class CvDBase(ClassifierBase):
         else:
             x_train, y_train, train_weights = x, y, sample_weight
             x_cv = y_cv = test_weights = None
+        self.compiled, self.prune_path = None, []
         self.feed_data(x_train)
+        self._prepare_split(x_train, split_method, max_bins)
         self.root.fit(x_train, y_train, train_weights, feature_bound, eps)
         self.prune(x_cv, y_cv, test_weights)
+        self.compile()
 
     @CvDBaseTiming.timeit(level=3, prefix="[Util] ")
     def reduce_nodes(self):
@@ -139,49 +188,119 @@ class CvDBase(ClassifierBase):
 
     @CvDBaseTiming.timeit(level=1)
     def _cart_prune(self):
-        self.root.cut_tree()
-        tmp_nodes = [node for node in self.nodes if node.category is None]
-        thresholds = np.array([node.get_threshold() for node in tmp_nodes])
+        """
+            Cost-complexity (weakest link) pruning path of the current tree, without modifying it
+            Every inner node t keeps R(t) (its cost as a leaf), R(T_t) (cost of its leafs) and |T_t|;
+              pruning t only changes these for its ancestors, so the whole path is computed on arrays
+            :return: [(alpha, node)], where the k-th subtree is the tree with the first k nodes pruned
+        """
+        tmp_nodes = [node for node in self.nodes if node.category is None and node.feature_dim is not None]
+        if not tmp_nodes:
+            return []
+        positions = {id(node): i for i, node in enumerate(tmp_nodes)}
+        parents = np.array([
+            positions.get(id(node.parent), -1) if node.parent is not None else -1 for node in tmp_nodes
+        ])
+        pruned_cost = np.array([node.cost(pruned=True) for node in tmp_nodes])
+        cost = np.array([node.cost() for node in tmp_nodes], dtype=np.float64)
+        n_leafs = np.array([len(node.leafs) for node in tmp_nodes], dtype=np.float64)
+        alive = np.ones(len(tmp_nodes), dtype=np.bool_)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            thresholds = (pruned_cost - cost) / (n_leafs - 1)
+        path = []
         while True:
-            root_copy = deepcopy(self.root)
-            self.roots.append(root_copy)
-            if self.root.height == 1:
+            p = int(np.flatnonzero(alive)[np.argmin(thresholds[alive])])
+            path.append((thresholds[p], tmp_nodes[p]))
+            if parents[p] == -1:
                 break
-            p = np.argmin(thresholds)  # type: int
-            tmp_nodes[p].prune()
-            for i, node in enumerate(tmp_nodes):
-                if node.affected:
-                    thresholds[i] = node.get_threshold()
-                    node.affected = False
-            pop = tmp_nodes.pop
-            for i in range(len(tmp_nodes) - 1, -1, -1):
-                if tmp_nodes[i].pruned:
-                    pop(i)
-                    thresholds = np.delete(thresholds, i)
-        self.reduce_nodes()
+            d_cost, d_leafs = cost[p] - pruned_cost[p], n_leafs[p] - 1
+            ancestor = parents[p]
+            while ancestor != -1:
+                cost[ancestor] -= d_cost
+                n_leafs[ancestor] -= d_leafs
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    thresholds[ancestor] = (pruned_cost[ancestor] - cost[ancestor]) / (n_leafs[ancestor] - 1)
+                ancestor = parents[ancestor]
+            # The pruned node and its inner descendants leave the path
+            stack = [p]
+            while stack:
+                local = stack.pop()
+                alive[local] = False
+                stack += [i for i in np.flatnonzero(parents == local) if alive[i]]
+        return path
+
+    def _prune_path_scores(self, path, x_cv, y_cv, weights):
+        """
+            CV accuracy of every subtree of the pruning path in one pass over the (full) compiled tree
+            A sample which passes through nodes pruned at steps s_1 > s_2 > ... (root to leaf) is
+              predicted by the class of the node pruned at s_i for subtrees s_i < k <= s_(i-1), and by its
+              leaf for k <= s_m, so each sample contributes a few intervals to a difference array
+        """
+        compiled = CompiledTree(self)
+        n_subtrees = len(path) + 1
+        steps = np.full(len(compiled.kind), n_subtrees, dtype=np.int64)
+        indices = {id(node): i for i, node in enumerate(CompiledTree.flatten(self.root)[0])}
+        for k, (_, node) in enumerate(path):
+            steps[indices[id(node)]] = k
+        gains = np.ones(len(y_cv)) if weights is None else np.asarray(weights, dtype=np.float64)
+        scores = np.zeros(n_subtrees + 1)
+
+        def _add(rows, local_nodes, start, end):
+            correct = (compiled.classes[local_nodes] == y_cv[rows]) * gains[rows]
+            np.add.at(scores, start, correct)
+            np.add.at(scores, end, -correct)
+
+        codes = compiled.encode(x_cv)
+        nodes = np.zeros(len(codes), dtype=np.int64)
+        upper = np.full(len(codes), n_subtrees, dtype=np.int64)
+        active = np.arange(len(codes))
+        while len(active):
+            current = nodes[active]
+            event = steps[current] + 1 < upper[active]
+            if np.any(event):
+                rows = active[event]
+                start = steps[current[event]] + 1
+                _add(rows, current[event], start, upper[rows])
+                upper[rows] = start
+            active = active[compiled.kind[current] != CompiledTree.LEAF]
+            targets = compiled.advance(codes, active, nodes[active])
+            stopped = targets < 0
+            _add(active[stopped], nodes[active[stopped]], np.zeros(np.sum(stopped), dtype=np.int64),
+                 upper[active[stopped]])
+            nodes[active[~stopped]] = targets[~stopped]
+            active = active[~stopped]
+        leafs = compiled.kind[nodes] == CompiledTree.LEAF
+        _add(np.flatnonzero(leafs), nodes[leafs], np.zeros(np.sum(leafs), dtype=np.int64), upper[leafs])
+        return np.cumsum(scores)[:-1] / len(y_cv)
 
     @CvDBaseTiming.timeit(level=3, prefix="[Util] ")
     def prune(self, x_cv, y_cv, weights):
         if self.root.is_cart:
             if x_cv is not None and y_cv is not None:
-                self._cart_prune()
-                arg = np.argmax([CvDBase.acc(y_cv, tree.predict(x_cv), weights) for tree in self.roots])  # type: int
-                tar_root = self.roots[arg]
+                self.prune_path = path = self._cart_prune()
+                if path:
+                    arg = int(np.argmax(self._prune_path_scores(path, x_cv, y_cv, weights)))
+                    for _, node in path[:arg]:
+                        node.prune()
                 self.nodes = []
-                tar_root.feed_tree(self)
-                self.root = tar_root
+                self.root.feed_tree(self)
         else:
             self._prune()
 
     # Util
 
+    @CvDBaseTiming.timeit(level=2, prefix="[API] ")
+    def compile(self):
+        self.compiled = CompiledTree(self)
+        return self.compiled
+
     @CvDBaseTiming.timeit(level=1, prefix="[API] ")
     def predict_one(self, x):
         return self.y_transformer[self.root.predict_one(x)]
 
     @CvDBaseTiming.timeit(level=3, prefix="[API] ")
     def predict(self, x, get_raw_results=False, **kwargs):
-        return self.y_transformer[self._multi_data(x, cvd_task, kwargs)]
+        return self.y_transformer[self._multi_data(x, cvd_task, kwargs, target=kwargs.get("target", "single"))]
 
     @CvDBaseTiming.timeit(level=3, prefix="[API] ")
     def view(self):
@@ -251,7 +370,7 @@ class CvDMeta(type):
 
         def __init__(self, whether_continuous=None, max_depth=None, node=None, **_kwargs):
             tmp_node = node if isinstance(node, CvDNode) else _node
-            CvDBase.__init__(self, whether_continuous, max_depth, tmp_node(**_kwargs))
+            CvDBase.__init__(self, whether_continuous, max_depth, tmp_node(**_kwargs), **_kwargs)
             self._name = name
 
         attr["__init__"] = __init__
@@ -14,6 +14,7 @@ from e_SVM.Perceptron import Perceptron
 from e_SVM.KP import KP
 from e_SVM.SVM import SVM
 
+from Util.Parallel import WorkerPool
 from Util.ProgressBar import ProgressBar
 
 from _SKlearn.NaiveBayes import *
@@ -53,6 +54,7 @@ class AdaBoost(ClassifierBase):
         self._params["clf"] = kwargs.get("clf", None)
         self._params["epoch"] = kwargs.get("epoch", 10)
         self._params["eps"] = kwargs.get("eps", 1e-12)
+        self._params["early_exit"] = kwargs.get("early_exit", False)
 
     @property
     def params(self):
@@ -80,6 +82,7 @@ class AdaBoost(ClassifierBase):
             epoch = self._params["epoch"]
         if eps is None:
             eps = self._params["eps"]
+        WorkerPool.release(self)
         x, y = np.atleast_2d(x), np.asarray(y)
         if clf is None:
             clf = "Cart"
@@ -104,16 +107,51 @@ class AdaBoost(ClassifierBase):
             bar.update()
         self._clfs_weights = np.array(self._clfs_weights, dtype=np.float32)
 
+    def _get_clfs(self, bound):
+        if bound is None:
+            return self._clfs, self._clfs_weights
+        return self._clfs[:bound], self._clfs_weights[:bound]
+
+    def staged_predict(self, x, get_raw_results=False, bound=None):
+        """
+            Yield predictions (or raw scores) after each estimator is added, using one running buffer
+              of size n_samples instead of the (n_samples, n_estimators) prediction matrix
+            Yielded scores are the running buffer itself, copy them if they need to be kept
+        """
+        x = np.atleast_2d(x)
+        clfs, clfs_weights = self._get_clfs(bound)
+        rs = np.zeros(len(x))
+        for clf, weight in zip(clfs, clfs_weights):
+            rs += weight * clf.predict(x)
+            yield rs if get_raw_results else np.sign(rs)
+
+    @AdaBoostTiming.timeit(level=2, prefix="[Core] ")
+    def _early_exit_predict(self, x, clfs, clfs_weights):
+        # remaining[i]: total |weight| of estimators i, i+1, ...; a row whose |score| exceeds the weight
+        #   which is still to come can no longer change its sign, so it leaves the active set
+        remaining = np.append(np.cumsum(np.abs(clfs_weights[::-1]))[::-1], 0)
+        rs, active = np.zeros(len(x)), np.arange(len(x))
+        for i, (clf, weight) in enumerate(zip(clfs, clfs_weights)):
+            if not len(active):
+                break
+            rs[active] += weight * clf.predict(x[active])
+            active = active[np.abs(rs[active]) <= remaining[i + 1]]
+        return np.sign(rs)
+
     @AdaBoostTiming.timeit(level=1, prefix="[API] ")
-    def predict(self, x, get_raw_results=False, bound=None, **kwargs):
+    def predict(self, x, get_raw_results=False, bound=None, early_exit=None, **kwargs):
+        """
+            :param early_exit : Accumulate votes estimator by estimator and stop evaluating rows whose sign is
+                                settled (labels only, ignored if get_raw_results)
+        """
+        if early_exit is None:
+            early_exit = self._params["early_exit"]
         x = np.atleast_2d(x)
-        if bound is None:
-            clfs, clfs_weights = self._clfs, self._clfs_weights
-        else:
-            clfs, clfs_weights = self._clfs[:bound], self._clfs_weights[:bound]
-        matrix = self._multi_clf(x, clfs, boost_task, kwargs)
-        matrix *= clfs_weights
-        rs = np.sum(matrix, axis=1)
+        clfs, clfs_weights = self._get_clfs(bound)
+        if early_exit and not get_raw_results:
+            return self._early_exit_predict(x, clfs, clfs_weights)
+        matrix = self._multi_clf(x, clfs, boost_task, kwargs, target=kwargs.get("target", "single"))
+        rs = matrix.dot(clfs_weights)
         del matrix
         if not get_raw_results:
             return np.sign(rs)
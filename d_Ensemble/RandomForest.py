@@ -7,12 +7,58 @@ if root_path not in sys.path:
 from c_CvDTree.Tree import *
 
 from Util.Util import DataUtil
+from Util.Parallel import WorkerPool
 from Util.ProgressBar import ProgressBar
 
 
+def rf_votes(matrix, n_classes):
+    """ Count class ids of a (n_samples, n_trees) matrix row by row, in one bincount """
+    n_samples = len(matrix)
+    offsets = matrix + np.arange(n_samples)[..., None] * n_classes
+    return np.bincount(offsets.ravel(), minlength=n_samples * n_classes).reshape(n_samples, n_classes)
+
+
 def rf_task(args):
     x, trees, n_cores = args
-    return [tree.predict(x, n_cores=n_cores) for tree in trees]
+    matrix = np.array([tree.predict(x, n_cores=n_cores) for tree in trees]).T
+    return rf_votes(matrix, int(matrix.max()) + 1)
+
+
+def rf_soft_task(args):
+    x, trees, n_cores = args
+    rs = np.zeros((len(x), max([int(tree.y_transformer[-1]) for tree in trees]) + 1))
+    for tree in trees:
+        rs[..., tree.y_transformer] += tree.predict_proba(x)
+    return rs
+
+
+def rf_fit_task(args):
+    x, (i, tree, kwargs, y, sample_weight, feature_bound, seed, oob, permutation), n_cores = args
+    np.random.seed(seed)
+    n_sample = len(y)
+    tmp_tree = RandomForest.cvd_trees[tree](**kwargs)
+    indices = np.random.randint(n_sample, size=n_sample)
+    if sample_weight is None:
+        local_weight = None
+    else:
+        local_weight = sample_weight[indices]
+        local_weight /= local_weight.sum()
+    tmp_tree.fit(x[indices], y[indices], sample_weight=local_weight, feature_bound=feature_bound)
+    compiled, oob_rs = tmp_tree.compiled, None
+    if oob or permutation:
+        oob_indices = np.flatnonzero(np.bincount(indices, minlength=n_sample) == 0)
+        x_oob, y_oob = x[oob_indices], y[oob_indices]
+        y_pred = compiled.predict(x_oob)
+        drops = None
+        if permutation and len(oob_indices):
+            # Decrease of OOB accuracy of this tree when each feature is shuffled
+            acc, drops = np.mean(y_pred == y_oob), np.zeros(x.shape[1])
+            for feat in range(x.shape[1]):
+                x_permuted = x_oob.copy()
+                x_permuted[..., feat] = x_oob[np.random.permutation(len(x_oob)), feat]
+                drops[feat] = acc - np.mean(compiled.predict(x_permuted) == y_oob)
+        oob_rs = (oob_indices, y_pred, drops)
+    return i, compiled, indices, oob_rs
 
 
 class RandomForest(ClassifierBase):
@@ -25,16 +71,55 @@ class RandomForest(ClassifierBase):
 
     def __init__(self, **kwargs):
         super(RandomForest, self).__init__(**kwargs)
-        self._tree, self._trees = "", []
+        self._tree, self._trees, self._classes = "", [], None
+        self._n_features = 0
+        self._bootstrap_indices, self._oob_votes, self._oob_y, self._permutation = [], None, None, None
 
         self._params["tree"] = kwargs.get("tree", "Cart")
         self._params["epoch"] = kwargs.get("epoch", 10)
         self._params["feature_bound"] = kwargs.get("feature_bound", "log")
+        self._params["n_jobs"] = kwargs.get("n_jobs", 1)
+        self._params["voting"] = kwargs.get("voting", "hard")
+        self._params["chunk_size"] = kwargs.get("chunk_size", None)
+        self._params["oob"] = kwargs.get("oob", False)
+        self._params["permutation"] = kwargs.get("permutation", False)
 
     @property
     def title(self):
         return "Tree: {}; Num: {}".format(self._tree, len(self._trees))
 
+    @property
+    def oob_prediction(self):
+        """ Majority vote of the trees for which each training sample is out-of-bag (None if it never is) """
+        if self._oob_votes is None:
+            return None
+        rs = self._classes[np.argmax(self._oob_votes, axis=1)].astype(object)
+        rs[np.sum(self._oob_votes, axis=1) == 0] = None
+        return rs
+
+    @property
+    def oob_score(self):
+        """ Accuracy of OOB predictions, over training samples which are out-of-bag for at least one tree """
+        if self._oob_votes is None:
+            return None
+        mask = np.sum(self._oob_votes, axis=1) > 0
+        return np.mean(np.argmax(self._oob_votes[mask], axis=1) == self._oob_y[mask])
+
+    @property
+    def feature_importances(self):
+        """ Mean decrease in impurity, averaged over trees """
+        if not self._trees:
+            return None
+        return np.mean([tree.feature_importances(self._n_features) for tree in self._trees], axis=0)
+
+    @property
+    def permutation_importances(self):
+        """ Mean decrease in OOB accuracy when each feature is shuffled, averaged over trees """
+        if self._permutation is None:
+            return None
+        drops, count = self._permutation
+        return drops / max(count, 1)
+
     @staticmethod
     @RandomForestTiming.timeit(level=2, prefix="[Core] ")
     def most_appearance(arr):
@@ -42,7 +127,17 @@ class RandomForest(ClassifierBase):
         return u[np.argmax(c)]
 
     @RandomForestTiming.timeit(level=1, prefix="[API] ")
-    def fit(self, x, y, sample_weight=None, tree=None, epoch=None, feature_bound=None, **kwargs):
+    def fit(self, x, y, sample_weight=None, tree=None, epoch=None, feature_bound=None, n_jobs=None,
+            oob=None, permutation=None, **kwargs):
+        """
+            Grow epoch bootstrap trees, each with its own seed drawn from np.random (so results only depend
+              on the global seed, not on n_jobs). Trees are kept in their compiled (array) form
+            Bootstrap indices of every tree are recorded; out-of-bag results are computed by the process
+              growing each tree and accumulated as trees complete, so no extra pass over x is needed
+            :param n_jobs      : Number of processes growing trees concurrently (1: in this process, <= 0: all cores)
+            :param oob         : Whether to collect OOB votes (oob_prediction, oob_score)
+            :param permutation : Whether to compute permutation importances on OOB samples (implies oob)
+        """
         if sample_weight is None:
             sample_weight = self._params["sample_weight"]
         if tree is None:
@@ -51,27 +146,87 @@ class RandomForest(ClassifierBase):
             epoch = self._params["epoch"]
         if feature_bound is None:
             feature_bound = self._params["feature_bound"]
-        x, y = np.atleast_2d(x), np.asarray(y)
-        n_sample = len(y)
-        self._tree = tree
+        if n_jobs is None:
+            n_jobs = self._params["n_jobs"]
+        if oob is None:
+            oob = self._params["oob"]
+        if permutation is None:
+            permutation = self._params["permutation"]
+        WorkerPool.release(self)
+        x = np.atleast_2d(x)
+        # Trees are grown on class ids of the forest, so that votes can be counted with bincount
+        self._classes, y = np.unique(y, return_inverse=True)
+        self._tree, self._n_features = tree, x.shape[1]
+        oob = oob or permutation
+        self._oob_y = y
+        self._oob_votes = np.zeros((len(y), len(self._classes)), dtype=np.int64) if oob else None
+        self._permutation = [np.zeros(x.shape[1]), 0] if permutation else None
+        seeds = np.random.randint(np.iinfo(np.int32).max, size=epoch)
+        args_lst = [
+            (i, tree, kwargs, y, sample_weight, feature_bound, seed, oob, permutation) for i, seed in enumerate(seeds)
+        ]
+        trees, bootstrap_indices = [None] * epoch, [None] * epoch
         bar = ProgressBar(max_value=epoch, name="RF")
-        for _ in range(epoch):
-            tmp_tree = RandomForest.cvd_trees[tree](**kwargs)
-            indices = np.random.randint(n_sample, size=n_sample)
-            if sample_weight is None:
-                local_weight = None
-            else:
-                local_weight = sample_weight[indices]
-                local_weight /= local_weight.sum()
-            tmp_tree.fit(x[indices], y[indices], sample_weight=local_weight, feature_bound=feature_bound)
-            self._trees.append(deepcopy(tmp_tree))
+        if n_jobs == 1:
+            state = np.random.get_state()
+            results = (rf_fit_task((x, args, 1)) for args in args_lst)
+        else:
+            state, results = None, WorkerPool.get(n_jobs).imap_data(x, rf_fit_task, args_lst)
+        for i, compiled, indices, oob_rs in results:
+            trees[i], bootstrap_indices[i] = compiled, indices
+            if oob_rs is not None:
+                self._update_oob(*oob_rs)
             bar.update()
+        if state is not None:
+            np.random.set_state(state)
+        self._trees, self._bootstrap_indices = trees, bootstrap_indices
+
+    def _update_oob(self, oob_indices, y_pred, drops):
+        np.add.at(self._oob_votes, (oob_indices, y_pred), 1)
+        if drops is not None:
+            self._permutation[0] += drops
+            self._permutation[1] += 1
+
+    @RandomForestTiming.timeit(level=2, prefix="[Core] ")
+    def _vote(self, x, trees, voting, kwargs):
+        task = rf_soft_task if voting == "soft" else rf_task
+        if kwargs.get("target", "parallel") == "parallel":
+            pool = self._get_worker_pool(kwargs)
+            if pool.n_cores > 1:
+                parts = pool.map_clfs(x, task, trees)
+            else:
+                parts = [task((x, trees, 1))]
+        else:
+            parts = [task((x, trees, 1))]
+        rs = np.zeros((len(x), len(self._classes)))
+        for part in parts:
+            rs[..., :part.shape[1]] += part
+        return rs / len(trees)
 
     @RandomForestTiming.timeit(level=1, prefix="[API] ")
-    def predict(self, x, get_raw_results=False, bound=None, **kwargs):
+    def predict(self, x, get_raw_results=False, bound=None, voting=None, chunk_size=None, **kwargs):
+        """
+            :param voting     : "hard" (majority of tree predictions) or "soft" (mean of leaf class distributions)
+            :param chunk_size : Number of rows evaluated at a time (None: all), bounds memory on large inputs
+            :return           : Labels, or per class vote fractions (columns follow sorted labels) if get_raw_results
+        """
+        if voting is None:
+            voting = self._params["voting"]
+        if chunk_size is None:
+            chunk_size = self._params["chunk_size"]
+        if voting not in ("hard", "soft"):
+            raise NotImplementedError("Voting method '{}' not defined".format(voting))
         trees = self._trees if bound is None else self._trees[:bound]
-        matrix = self._multi_clf(x, trees, rf_task, kwargs, target=kwargs.get("target", "parallel"))
-        return np.array([RandomForest.most_appearance(rs) for rs in matrix])
+        x = np.atleast_2d(x)
+        if chunk_size is None or chunk_size >= len(x):
+            rs = self._vote(x, trees, voting, kwargs)
+        else:
+            rs = np.vstack([
+                self._vote(x[i:i + chunk_size], trees, voting, kwargs) for i in range(0, len(x), chunk_size)
+            ])
+        if get_raw_results:
+            return rs
+        return self._classes[np.argmax(rs, axis=1)]
 
     @RandomForestTiming.timeit(level=1, prefix="[API] ")
     def evaluate(self, x, y, metrics=None, tar=0, prefix="Acc", **kwargs):
@@ -0,0 +1,113 @@
+import os
+import sys
+root_path = os.path.abspath("../")
+if root_path not in sys.path:
+    sys.path.append(root_path)
+
+import gc
+import unittest
+import numpy as np
+
+from c_CvDTree.Tree import CartTree
+from d_Ensemble.AdaBoost import AdaBoost
+from d_Ensemble.RandomForest import RandomForest
+from Util.Util import DataUtil
+from Util.Parallel import WorkerPool
+
+
+class Model:
+    def __init__(self, scale):
+        self.scale = scale
+
+
+def scale_task(args):
+    x, model, n_cores = args
+    return x * model.scale
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(2)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_00_shared_pool(self):
+        self.assertIs(WorkerPool.get(2), WorkerPool.get(2), "Shared pools are not reused")
+
+    def test_01_map_data(self):
+        x = np.arange(20, dtype=np.float64).reshape(10, 2)
+        rs = np.vstack(self.pool.map_data(x, scale_task, Model(2.)))
+        self.assertTrue(np.array_equal(rs, 2 * x), "map_data does not cover every row")
+        x = np.arange(200, dtype=np.float32).reshape(50, 4)
+        rs = np.vstack(self.pool.map_data(x, scale_task, Model(3.)))
+        self.assertTrue(np.array_equal(rs, 3 * x), "map_data fails after the input block grows")
+
+    def test_02_publish_once(self):
+        model = Model(1.)
+        self.assertEqual(self.pool.publish([model]), self.pool.publish([model]), "Model is published twice")
+
+    def test_03_release(self):
+        model = Model(1.)
+        key = self.pool.publish([model])[0]
+        WorkerPool.release(model)
+        self.assertEqual(len(self.pool._published), 0, "Released model is still published")
+        self.assertNotEqual(self.pool.publish([model])[0], key, "Released model keeps its key")
+
+    def test_04_collected_models_are_dropped(self):
+        self.pool.publish([Model(1.)])
+        gc.collect()
+        self.assertEqual(len(self.pool._published), 0, "Collected model is still published")
+
+    def test_05_refit_releases(self):
+        x, y = DataUtil.gen_xor(size=200, one_hot=False)
+        tree = CartTree()
+        for flip in (False, True):
+            tree.fit(x, -y if flip else y, train_only=True)
+            self.assertTrue(np.array_equal(
+                tree.predict(x, target="parallel", pool=self.pool), tree.predict(x)
+            ), "Parallel predictions use a stale model after refit")
+
+
+class TestRandomForest(unittest.TestCase):
+    @staticmethod
+    def _fit(x, y, n_jobs, **kwargs):
+        np.random.seed(0)
+        forest = RandomForest()
+        forest.fit(x, y, epoch=8, n_jobs=n_jobs, **kwargs)
+        return forest
+
+    def test_00_fit_n_jobs(self):
+        x, y = DataUtil.gen_spiral(50, 4, 3, 2, one_hot=False)
+        single, parallel = self._fit(x, y, 1, oob=True), self._fit(x, y, 2, oob=True)
+        for voting in ("hard", "soft"):
+            self.assertTrue(np.array_equal(
+                single.predict(x, get_raw_results=True, voting=voting, target="single"),
+                parallel.predict(x, get_raw_results=True, voting=voting, target="single")
+            ), "Forests grown with different n_jobs differ ({} voting)".format(voting))
+        self.assertEqual(single.oob_score, parallel.oob_score, "OOB scores depend on n_jobs")
+
+    def test_01_parallel_predict(self):
+        x, y = DataUtil.gen_spiral(50, 4, 3, 2, one_hot=False)
+        forest = self._fit(x, y, 1)
+        self.assertTrue(np.array_equal(
+            forest.predict(x, get_raw_results=True, target="single"),
+            forest.predict(x, get_raw_results=True, target="parallel", n_cores=2)
+        ), "Parallel votes differ from in-process votes")
+
+
+class TestAdaBoost(unittest.TestCase):
+    def test_00_parallel_predict(self):
+        x, y = DataUtil.gen_spiral(50, 4, 2, 2, one_hot=False)
+        y[y == 0] = -1
+        np.random.seed(0)
+        boost = AdaBoost()
+        boost.fit(x, y, epoch=10)
+        self.assertTrue(np.allclose(
+            boost.predict(x, get_raw_results=True, target="single"),
+            boost.predict(x, get_raw_results=True, target="parallel", n_cores=2)
+        ), "Parallel predictions differ from in-process predictions")
+
+
+if __name__ == '__main__':
+    unittest.main()
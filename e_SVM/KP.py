@@ -13,12 +13,23 @@ from Util.Bases import KernelBase, GDKernelBase
 
 
 class KP(KernelBase):
+    """
+        Kernel perceptron
+        batch_size = None : every epoch updates the one (weighted) misclassified sample found first
+        batch_size = k    : every epoch draws k samples and updates all misclassified ones among them at once,
+                              with a single rank-k update of the prediction cache
+    """
+
     KernelPerceptronTiming = Timing()
 
     def __init__(self, **kwargs):
         super(KP, self).__init__(**kwargs)
+        self._cache_gram = True
+        self._batch_size = None
         self._fit_args, self._fit_args_names = [0.01], ["lr"]
 
+        self._params["batch_size"] = kwargs.get("batch_size", None)
+
     @KernelPerceptronTiming.timeit(level=1, prefix="[Core] ")
     def _update_dw_cache(self, idx, lr, sample_weight):
         self._dw_cache = lr * self._y[idx] * sample_weight[idx]
@@ -26,12 +37,17 @@ class KP(KernelBase):
 
     @KernelPerceptronTiming.timeit(level=1, prefix="[Core] ")
     def _update_db_cache(self, idx, lr, sample_weight):
-        self._db_cache = self._dw_cache
+        self._db_cache = np.sum(self._dw_cache)
         self._b += self._db_cache
 
+    def _prepare(self, sample_weight, **kwargs):
+        self._batch_size = kwargs.get("batch_size", self._params["batch_size"])
+
     @KernelPerceptronTiming.timeit(level=1, prefix="[Core] ")
     def _fit(self, sample_weight, lr):
         err = (np.sign(self._prediction_cache) != self._y) * sample_weight
+        if self._batch_size is not None:
+            return self._fit_batch(err, sample_weight, lr)
         indices = np.random.permutation(len(self._y))
         idx = indices[np.argmax(err[indices])]
         if self._prediction_cache[idx] == self._y[idx]:
@@ -40,13 +56,26 @@ class KP(KernelBase):
         self._update_db_cache(idx, lr, sample_weight)
         self._update_pred_cache(idx)
 
+    @KernelPerceptronTiming.timeit(level=1, prefix="[Core] ")
+    def _fit_batch(self, err, sample_weight, lr):
+        if not np.any(err > 0):
+            return True
+        batch = np.random.permutation(len(self._y))[:self._batch_size]
+        batch = batch[err[batch] > 0]
+        if len(batch) == 0:
+            return
+        self._update_dw_cache(batch, lr, sample_weight)
+        self._update_db_cache(batch, lr, sample_weight)
+        self._update_pred_cache(batch)
+
 
 class GDKP(GDKernelBase):
     GDKPTiming = Timing()
 
     @GDKPTiming.timeit(level=1, prefix="[Core] ")
     def _get_grads(self, x_batch, y_batch, y_pred, sample_weight_batch, *args):
-        err = -y_batch * (x_batch.dot(self._alpha) + self._b) * sample_weight_batch
+        # y_pred = x_batch.dot(alpha) + b was just computed by _batch_training
+        err = -y_batch * y_pred * sample_weight_batch
         mask = err >= 0  # type: np.ndarray
         if not np.any(mask):
             self._model_grads = [None, None]
@@ -6,12 +6,14 @@ if root_path not in sys.path:
 
 import numpy as np
 import tensorflow as tf
+from copy import copy
 
 from NN.Basic.Optimizers import OptFactory
 from NN.TF.Optimizers import OptFactory as TFOptFac
 
 from Util.Timing import Timing
 from Util.ProgressBar import ProgressBar
+from Util.Kernel import as_matrix, issparse
 from Util.Bases import GDBase, TFClassifierBase, TorchAutoClassifierBase
 
 try:
@@ -35,6 +37,7 @@ class LinearSVM(GDBase):
         self._params["epoch"] = kwargs.get("epoch", 10 ** 4)
         self._params["tol"] = kwargs.get("tol", 1e-3)
         self._params["optimizer"] = kwargs.get("optimizer", "Adam")
+        self._params["warm_start"] = kwargs.get("warm_start", False)
 
     @LinearSVMTiming.timeit(level=1, prefix="[Core] ")
     def _get_grads(self, x_batch, y_batch, y_pred, sample_weight_batch, *args):
@@ -45,15 +48,19 @@ class LinearSVM(GDBase):
             self._model_grads = [None, None]
         else:
             delta = -c * y_batch[mask] * sample_weight_batch[mask]
-            self._model_grads = [
-                np.sum(delta[..., None] * x_batch[mask], axis=0),
-                np.sum(delta)
-            ]
+            if issparse(x_batch):
+                dw = x_batch[np.flatnonzero(mask)].T.dot(delta)
+            else:
+                dw = np.sum(delta[..., None] * x_batch[mask], axis=0)
+            self._model_grads = [dw, np.sum(delta)]
         return np.sum(err[mask]) + c * np.linalg.norm(self._w)
 
     @LinearSVMTiming.timeit(level=1, prefix="[API] ")
     def fit(self, x, y, sample_weight=None, c=None, lr=None, optimizer=None,
-            batch_size=None, epoch=None, tol=None, animation_params=None):
+            batch_size=None, epoch=None, tol=None, animation_params=None, warm_start=None):
+        """
+            :param warm_start : Whether to start from the current _w & _b (if any) instead of zeros
+        """
         if sample_weight is None:
             sample_weight = self._params["sample_weight"]
         if c is None:
@@ -68,15 +75,21 @@ class LinearSVM(GDBase):
             tol = self._params["tol"]
         if optimizer is None:
             optimizer = self._params["optimizer"]
+        if warm_start is None:
+            warm_start = self._params["warm_start"]
         *animation_properties, animation_params = self._get_animation_params(animation_params)
-        x, y = np.atleast_2d(x), np.asarray(y, dtype=np.float32)
+        x, y = as_matrix(x), np.asarray(y, dtype=np.float32)
         if sample_weight is None:
             sample_weight = np.ones(len(y))
         else:
             sample_weight = np.asarray(sample_weight) * len(y)
 
-        self._w = np.zeros(x.shape[1], dtype=np.float32)
-        self._b = np.zeros(1, dtype=np.float32)
+        if warm_start and self._w is not None and len(self._w) == x.shape[1]:
+            # Copies: parameters are updated in place, and may be shared with earlier models (see fit_path)
+            self._w, self._b = self._w.copy(), self._b.copy()
+        else:
+            self._w = np.zeros(x.shape[1], dtype=np.float32)
+            self._b = np.zeros(1, dtype=np.float32)
         self._model_parameters = [self._w, self._b]
         self._optimizer = OptFactory().get_optimizer_by_name(
             optimizer, self._model_parameters, lr, epoch
@@ -99,11 +112,35 @@ class LinearSVM(GDBase):
 
     @LinearSVMTiming.timeit(level=1, prefix="[API] ")
     def predict(self, x, get_raw_results=False, **kwargs):
-        rs = np.sum(self._w * x, axis=1) + self._b
+        if issparse(x):
+            rs = x.dot(self._w) + self._b
+        else:
+            rs = np.sum(self._w * x, axis=1) + self._b
         if get_raw_results:
             return rs
         return np.sign(rs)
 
+    @LinearSVMTiming.timeit(level=1, prefix="[API] ")
+    def fit_path(self, x, y, cs, x_test=None, y_test=None, metrics=None, **kwargs):
+        """
+            Fit one model per c (in the given order), each one warm-started from the solution of the previous c
+            :param kwargs : Passed to fit
+            :return       : Fitted models (one per c), and their metrics on (x_test, y_test) (or on (x, y)
+                              if no test set is given) as a (len(cs), len(metrics)) array
+        """
+        if metrics is None:
+            metrics = ["acc"]
+        if x_test is None or y_test is None:
+            x_test, y_test = x, y
+        models, logs = [], []
+        for i, c in enumerate(cs):
+            self.fit(x, y, c=c, warm_start=i > 0, **kwargs)
+            model = copy(self)
+            model._params = dict(self._params, c=c)
+            models.append(model)
+            logs.append(model.evaluate(x_test, y_test, metrics=list(metrics), tar=None))
+        return models, np.array(logs)
+
 
 class TFLinearSVM(TFClassifierBase):
     TFLinearSVMTiming = Timing()
@@ -0,0 +1,200 @@
+import os
+import sys
+root_path = os.path.abspath("../")
+if root_path not in sys.path:
+    sys.path.append(root_path)
+
+import itertools
+import numpy as np
+
+from e_SVM.KP import KP
+from e_SVM.SVM import SVM
+from e_SVM.LinearSVM import LinearSVM
+from e_SVM.Perceptron import Perceptron
+
+from Util.Util import DataUtil
+from Util.Timing import Timing
+from Util.Kernel import KernelCache
+from Util.Parallel import WorkerPool
+from Util.ProgressBar import ProgressBar
+from Util.Bases import ClassifierBase, KernelBase
+
+def mc_fit_task(args):
+    x, (batch, share_cache), n_cores = args
+    # Kernel caches only live as long as the batch, so workers do not hold them once the fit is done
+    caches, results = {}, []
+    for i, model, params, kwargs, indices, y, sample_weight, seed in batch:
+        np.random.seed(seed)
+        clf = MultiClassSVM.binary_models[model](**params)
+        local_kwargs = dict(kwargs)
+        if share_cache and isinstance(clf, KernelBase) and clf._cache_gram:
+            kernel = clf._init_kernel(x, **kwargs)
+            cache = caches.get(str(kernel))
+            if cache is None:
+                cache = caches[str(kernel)] = KernelCache(
+                    kernel, x, kwargs.get("cache_size", clf._params["cache_size"]))
+            local_kwargs["gram"] = cache if indices is None else cache.subset(indices)
+        clf.fit(x if indices is None else x[indices], y, sample_weight=sample_weight, **local_kwargs)
+        if isinstance(clf, KernelBase):
+            # Training state is not needed for predictions, and should not be sent back to the parent process
+            clf._gram = clf._prediction_cache = None
+        results.append((i, clf))
+    return results
+
+
+class MultiClassSVM(ClassifierBase):
+    """
+        Multiclass classifier built from the binary (+1 / -1) classifiers of e_SVM
+        Strategies:
+            1) "ovr" : one model per class, trained on (class vs rest)
+            2) "ovo" : one model per pair of classes, trained on the samples of these two classes
+        Binary models are independent, so they are fitted by n_jobs processes (Util.Parallel.WorkerPool),
+          each process fitting one batch of them
+        For kernel models solved with a KernelCache (SVM, KP), all sub-problems of a batch share a single
+          cache over the whole x when their kernels are identical (one-vs-one pairs read their sub-matrix
+          through a KernelCacheView), so each Gram row is computed at most once per process; the cache is
+          released as soon as the batch is fitted
+        Predictions are aggregated with matrix products:
+            1) "ovr" : argmax of raw outputs
+            2) "ovo" : argmax of votes, ties broken by the sum of (bounded) raw outputs
+    """
+
+    MultiClassSVMTiming = Timing()
+    binary_models = {
+        "SVM": SVM,
+        "KP": KP,
+        "LinearSVM": LinearSVM,
+        "Perceptron": Perceptron
+    }
+
+    def __init__(self, **kwargs):
+        super(MultiClassSVM, self).__init__(**kwargs)
+        self._model = self._strategy = ""
+        self._models, self._pairs, self._classes = [], None, None
+
+        self._params["model"] = kwargs.get("model", "SVM")
+        self._params["model_params"] = kwargs.get("model_params", {})
+        self._params["strategy"] = kwargs.get("strategy", "ovr")
+        self._params["n_jobs"] = kwargs.get("n_jobs", 1)
+        self._params["share_cache"] = kwargs.get("share_cache", True)
+
+    @property
+    def title(self):
+        return "Model: {}; Strategy: {}; Num: {}".format(self._model, self._strategy, len(self._models))
+
+    def _get_sub_problems(self, y, sample_weight):
+        if self._strategy == "ovr":
+            for i in range(len(self._classes)):
+                yield None, np.where(y == i, 1., -1.), sample_weight
+            return
+        for i, j in self._pairs:
+            indices = np.flatnonzero((y == i) | (y == j))
+            local_weight = None
+            if sample_weight is not None:
+                local_weight = sample_weight[indices]
+                local_weight = local_weight / local_weight.sum()
+            yield indices, np.where(y[indices] == i, 1., -1.), local_weight
+
+    @MultiClassSVMTiming.timeit(level=1, prefix="[API] ")
+    def fit(self, x, y, sample_weight=None, model=None, strategy=None, n_jobs=None, share_cache=None, **kwargs):
+        """
+            Fit every binary model, each with its own seed drawn from np.random (so results only depend
+              on the global seed, not on n_jobs)
+            :param model       : Name of the binary model (see binary_models)
+            :param strategy    : "ovr" or "ovo"
+            :param n_jobs      : Number of processes fitting models concurrently (1: in this process, <= 0: all cores)
+            :param share_cache : Whether kernel models share one KernelCache per batch
+            :param kwargs      : Passed to the fit method of every binary model
+        """
+        if sample_weight is None:
+            sample_weight = self._params["sample_weight"]
+        if model is None:
+            model = self._params["model"]
+        if strategy is None:
+            strategy = self._params["strategy"]
+        if n_jobs is None:
+            n_jobs = self._params["n_jobs"]
+        if share_cache is None:
+            share_cache = self._params["share_cache"]
+        if strategy not in ("ovr", "ovo"):
+            raise NotImplementedError("Strategy '{}' not defined".format(strategy))
+        x = np.atleast_2d(x)
+        self._classes, y = np.unique(y, return_inverse=True)
+        if sample_weight is not None:
+            sample_weight = np.asarray(sample_weight, dtype=np.float64)
+        self._model, self._strategy = model, strategy
+        n_classes = len(self._classes)
+        self._pairs = None if strategy == "ovr" else np.array(list(itertools.combinations(range(n_classes), 2)))
+        sub_problems = list(self._get_sub_problems(y, sample_weight))
+        seeds = np.random.randint(np.iinfo(np.int32).max, size=len(sub_problems))
+        args_lst = [
+            (i, model, self._params["model_params"], kwargs, indices, sub_y, local_weight, seed)
+            for i, ((indices, sub_y, local_weight), seed) in enumerate(zip(sub_problems, seeds))
+        ]
+        models = [None] * len(args_lst)
+        bar = ProgressBar(max_value=len(args_lst), name="MultiClassSVM")
+        if n_jobs == 1:
+            state = np.random.get_state()
+            results = [mc_fit_task((x, (args_lst, share_cache), 1))]
+        else:
+            pool = WorkerPool.get(n_jobs)
+            # Interleaved batches, one per process, so that batches hold sub-problems of similar sizes
+            n_batches = min(pool.n_cores, len(args_lst))
+            batches = [(args_lst[k::n_batches], share_cache) for k in range(n_batches)]
+            state, results = None, pool.imap_data(x, mc_fit_task, batches)
+        for batch_results in results:
+            for i, clf in batch_results:
+                models[i] = clf
+                bar.update()
+        if state is not None:
+            np.random.set_state(state)
+        self._models = models
+
+    @MultiClassSVMTiming.timeit(level=2, prefix="[Core] ")
+    def _raw_outputs(self, x):
+        return np.array([clf.predict(x, get_raw_results=True) for clf in self._models], dtype=np.float64).T
+
+    @MultiClassSVMTiming.timeit(level=1, prefix="[API] ")
+    def predict(self, x, get_raw_results=False, **kwargs):
+        """
+            :return : Labels, or per class scores (columns follow sorted labels) if get_raw_results
+        """
+        raw = self._raw_outputs(np.atleast_2d(x))
+        if self._strategy == "ovr":
+            rs = raw
+        else:
+            n_classes = len(self._classes)
+            first = np.eye(n_classes)[self._pairs[..., 0]]
+            second = np.eye(n_classes)[self._pairs[..., 1]]
+            positive = (raw > 0).astype(np.float64)
+            votes = positive.dot(first) + (1 - positive).dot(second)
+            confidences = raw.dot(first) - raw.dot(second)
+            # Scaled into (-1/3, 1/3), so confidences only break ties between vote counts
+            rs = votes + confidences / (3 * (np.abs(confidences) + 1))
+        if get_raw_results:
+            return rs
+        return self._classes[np.argmax(rs, axis=1)]
+
+
+if __name__ == '__main__':
+    import time
+
+    x, y = DataUtil.gen_spiral(20, 4, 3, 2, one_hot=False)
+
+    for _strategy in ("ovr", "ovo"):
+        learning_time = time.time()
+        svm = MultiClassSVM(strategy=_strategy)
+        svm.fit(x, y, kernel="rbf", gamma=5)
+        learning_time = time.time() - learning_time
+        estimation_time = time.time()
+        svm.evaluate(x, y)
+        estimation_time = time.time() - estimation_time
+        print(
+            "Model building  : {:12.6} s\n"
+            "Estimation      : {:12.6} s\n"
+            "Total           : {:12.6} s".format(
+                learning_time, estimation_time,
+                learning_time + estimation_time
+            )
+        )
+    svm.show_timing_log()
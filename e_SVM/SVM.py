@@ -6,10 +6,12 @@ if root_path not in sys.path:
 
 import numpy as np
 import tensorflow as tf
+from copy import copy
 
 from NN.TF.Optimizers import OptFactory as TFOptFac
 
 from Util.Timing import Timing
+from Util.Kernel import KernelCache
 from Util.Bases import KernelBase, GDKernelBase, TFKernelBase, TorchKernelBase
 
 try:
@@ -25,8 +27,15 @@ class SVM(KernelBase):
 
     def __init__(self, **kwargs):
         super(SVM, self).__init__(**kwargs)
+        self._cache_gram = True
         self._fit_args, self._fit_args_names = [1e-3], ["tol"]
-        self._c = None
+        self._c = self._diag = self._active = None
+        self._active_gram = self._positions = self._cache_size = None
+        self._selection, self._shrinking = None, False
+        self._n_iter, self._shrink_period = 0, 1000
+
+        self._params["selection"] = kwargs.get("selection", "wss2")
+        self._params["shrinking"] = kwargs.get("shrinking", True)
 
     @SVMTiming.timeit(level=1, prefix="[SMO] ")
     def _pick_first(self, tol):
@@ -51,6 +60,104 @@ class SVM(KernelBase):
             idx = np.random.randint(len(self._y))
         return idx
 
+    def _take(self, arr):
+        # Entries of arr on the active set (self._active is None when every alpha is active)
+        return arr if self._active is None else arr[self._active]
+
+    def _set_active(self, active):
+        """
+            Cached Gram rows are only computed on the active set (as libsvm does): once shrunk, rows are served
+              by a KernelCache over the active samples, so their length & cost follow the active set
+        """
+        self._active = active
+        self._active_gram = self._positions = None
+        if active is not None and not isinstance(self._gram, np.ndarray):
+            self._positions = np.full(len(self._y), -1, dtype=np.int64)
+            self._positions[active] = np.arange(len(active))
+            self._active_gram = KernelCache(self._kernel, self._x[active], self._cache_size)
+
+    def _get_row(self, idx):
+        # Active columns of a Gram row
+        if self._active is None:
+            return self._gram[idx]
+        if self._active_gram is None:
+            return self._gram[idx][self._active]
+        return self._active_gram[int(self._positions[idx])]
+
+    def _get_entry(self, idx1, idx2):
+        if self._active_gram is None:
+            return self._gram[idx1][idx2]
+        return self._active_gram[int(self._positions[idx1])][self._positions[idx2]]
+
+    @SVMTiming.timeit(level=2, prefix="[SMO] ")
+    def _get_up_low(self):
+        # Active positions whose alpha can move up / down along y (I_up / I_low of the dual problem)
+        pos, alpha = self._take(self._y) > 0, self._take(self._alpha)
+        below_c, above_0 = alpha < self._c, alpha > 0
+        return (pos & below_c) | (~pos & above_0), (~pos & below_c) | (pos & above_0)
+
+    @SVMTiming.timeit(level=1, prefix="[SMO] ")
+    def _pick_wss2(self, tol):
+        """
+            Second order working set selection (WSS2, as in libsvm) over the active set
+            With score = y - f(x) (= -y * gradient, up to b): idx1 is the maximal violating index in I_up,
+              idx2 maximizes the second order gain (score_1 - score_2)^2 / eta among I_low
+            Only active entries are read, so each step costs O(active set)
+            :return: (idx1, idx2), or None if max_up(score) - min_low(score) < tol
+        """
+        score = self._take(self._y) - self._take(self._prediction_cache)
+        up, low = self._get_up_low()
+        up, low = np.flatnonzero(up), np.flatnonzero(low)
+        if not len(up) or not len(low):
+            return
+        pos1 = up[np.argmax(score[up])]
+        if score[pos1] - np.min(score[low]) < tol:
+            return
+        candidates = low[score[low] < score[pos1]]
+        idx1 = pos1 if self._active is None else self._active[pos1]
+        eta = self._take(self._diag)[candidates] + self._diag[idx1] - 2 * self._get_row(idx1)[candidates]
+        eta[eta <= 0] = 1e-12
+        idx2 = candidates[np.argmax((score[pos1] - score[candidates]) ** 2 / eta)]
+        return idx1, idx2 if self._active is None else self._active[idx2]
+
+    @SVMTiming.timeit(level=1, prefix="[SMO] ")
+    def _shrink(self):
+        """
+            Drop from the active set the bounded alphas which cannot be selected by _pick_wss2 under the
+              current violation range of the active set; their prediction cache entries are not updated
+              any more until _unshrink rebuilds them (as libsvm does with its gradient)
+        """
+        score = self._take(self._y) - self._take(self._prediction_cache)
+        up, low = self._get_up_low()
+        if not np.any(up) or not np.any(low):
+            return
+        m, big_m = np.max(score[up]), np.min(score[low])
+        keep = np.flatnonzero(~((up & ~low & (score < big_m)) | (low & ~up & (score > m))))
+        if len(keep) == len(score):
+            return
+        self._set_active(keep if self._active is None else self._active[keep])
+
+    @SVMTiming.timeit(level=1, prefix="[SMO] ")
+    def _sync_prediction_cache(self):
+        """ Rebuild the (stale) prediction cache entries of shrunk alphas from the support vectors """
+        if self._active is None:
+            return
+        inactive = np.ones(len(self._y), dtype=np.bool_)
+        inactive[self._active] = False
+        inactive = np.flatnonzero(inactive)
+        support = np.flatnonzero(self._w)
+        rs = np.full(len(inactive), float(self._b))
+        if len(support):
+            if isinstance(self._gram, np.ndarray):
+                rs += self._w[support].dot(self._gram[np.ix_(support, inactive)])
+            else:
+                rs += self._kernel.dot(self._x[inactive], self._x[support], self._w[support])
+        self._prediction_cache[inactive] = rs
+
+    def _unshrink(self):
+        self._sync_prediction_cache()
+        self._set_active(None)
+
     @SVMTiming.timeit(level=2, prefix="[SMO] ")
     def _get_lower_bound(self, idx1, idx2):
         if self._y[idx1] != self._y[idx2]:
@@ -69,7 +176,7 @@ class SVM(KernelBase):
         y1, y2 = self._y[idx1], self._y[idx2]
         e1 = self._prediction_cache[idx1] - self._y[idx1]
         e2 = self._prediction_cache[idx2] - self._y[idx2]
-        eta = self._gram[idx1][idx1] + self._gram[idx2][idx2] - 2 * self._gram[idx1][idx2]
+        eta = self._get_entry(idx1, idx1) + self._get_entry(idx2, idx2) - 2 * self._get_entry(idx1, idx2)
         a2_new = self._alpha[idx2] + (y2 * (e1 - e2)) / eta
         if a2_new > h:
             a2_new = h
@@ -77,13 +184,32 @@ class SVM(KernelBase):
             a2_new = l
         a1_old, a2_old = self._alpha[idx1], self._alpha[idx2]
         da2 = a2_new - a2_old
-        da1 = -y1 * y2 * da2
+        # Snap alpha1 onto its bounds, otherwise round-off keeps it "free" (and selectable) forever
+        a1_new = a1_old - y1 * y2 * da2
+        eps = 1e-12 * self._c
+        if a1_new < eps:
+            a1_new = 0.
+        elif a1_new > self._c - eps:
+            a1_new = self._c
+        da1 = a1_new - a1_old
         self._alpha[idx1] += da1
         self._alpha[idx2] = a2_new
         self._update_dw_cache(idx1, idx2, da1, da2, y1, y2)
         self._update_db_cache(idx1, idx2, da1, da2, y1, y2, e1, e2)
         self._update_pred_cache(idx1, idx2)
 
+    @SVMTiming.timeit(level=1, prefix="[Core] ")
+    def _update_pred_cache(self, *args):
+        if self._active is None:
+            return super(SVM, self)._update_pred_cache(*args)
+        # Shrunk entries are rebuilt by _sync_prediction_cache, so only active columns are updated
+        indices, dw = np.asarray(args, dtype=np.int64), np.asarray(self._dw_cache, dtype=np.float64)
+        mask = dw != 0
+        local = np.full(len(self._active), float(self._db_cache))
+        for idx, local_dw in zip(indices[mask], dw[mask]):
+            local += local_dw * self._get_row(int(idx))
+        self._prediction_cache[self._active] += local
+
     @SVMTiming.timeit(level=1, prefix="[Core] ")
     def _update_dw_cache(self, idx1, idx2, da1, da2, y1, y2):
         self._dw_cache = np.array([da1 * y1, da2 * y2])
@@ -92,31 +218,92 @@ class SVM(KernelBase):
 
     @SVMTiming.timeit(level=1, prefix="[Core] ")
     def _update_db_cache(self, idx1, idx2, da1, da2, y1, y2, e1, e2):
-        gram_12 = self._gram[idx1][idx2]
-        b1 = -e1 - y1 * self._gram[idx1][idx1] * da1 - y2 * gram_12 * da2
-        b2 = -e2 - y1 * gram_12 * da1 - y2 * self._gram[idx2][idx2] * da2
+        gram_12 = self._get_entry(idx1, idx2)
+        b1 = -e1 - y1 * self._get_entry(idx1, idx1) * da1 - y2 * gram_12 * da2
+        b2 = -e2 - y1 * gram_12 * da1 - y2 * self._get_entry(idx2, idx2) * da2
         self._db_cache = (b1 + b2) * 0.5
         self._b += self._db_cache
 
     @SVMTiming.timeit(level=4, prefix="[Util] ")
     def _prepare(self, sample_weight, **kwargs):
         self._c = kwargs.get("c", self._params["c"])
+        self._selection = kwargs.get("selection", self._params["selection"])
+        self._shrinking = kwargs.get("shrinking", self._params["shrinking"])
+        if self._selection not in ("wss2", "random"):
+            raise NotImplementedError("Working set selection '{}' not defined".format(self._selection))
+        self._diag = self._gram.diagonal()
+        self._cache_size = kwargs.get("cache_size", self._params["cache_size"])
+        self._set_active(None)
+        self._n_iter, self._shrink_period = 0, min(len(self._y), 1000)
+        alpha = kwargs.get("alpha")
+        if alpha is not None:
+            # Warm start: SMO only needs a feasible alpha, and caches consistent with it
+            self._alpha[:] = np.clip(alpha, 0, self._c)
+            self._w[:] = self._alpha * self._y
+            self._b = kwargs.get("b", 0.)
+            self._prediction_cache[:] = self._b
+            support = np.flatnonzero(self._w)
+            if len(support):
+                self._prediction_cache += self._w[support].dot(self._gram[support])
 
     @SVMTiming.timeit(level=1, prefix="[Core] ")
     def _fit(self, sample_weight, tol):
-        idx1 = self._pick_first(tol)
-        if idx1 is None:
-            return True
-        idx2 = self._pick_second(idx1)
+        if self._selection == "random":
+            idx1 = self._pick_first(tol)
+            if idx1 is None:
+                return True
+            idx2 = self._pick_second(idx1)
+        else:
+            self._n_iter += 1
+            if self._shrinking and self._n_iter % self._shrink_period == 0:
+                self._shrink()
+            working_set = self._pick_wss2(tol)
+            if working_set is None and self._active is not None:
+                # Converged on the active set, rebuild the shrunk entries & check again on every alpha
+                self._unshrink()
+                working_set = self._pick_wss2(tol)
+            if working_set is None:
+                return True
+            idx1, idx2 = working_set
         self._update_alpha(idx1, idx2)
 
+    @SVMTiming.timeit(level=1, prefix="[API] ")
+    def fit_path(self, x, y, cs, x_test=None, y_test=None, metrics=None, **kwargs):
+        """
+            Fit one model per c (in the given order) on a shared Gram cache, each one warm-started from the
+              solution of the previous c with alpha scaled by c / previous c (which keeps it feasible)
+            :param kwargs : Passed to fit
+            :return       : Fitted models (one per c), and their metrics on (x_test, y_test) (or on (x, y)
+                              if no test set is given) as a (len(cs), len(metrics)) array
+        """
+        if metrics is None:
+            metrics = ["acc"]
+        if x_test is None or y_test is None:
+            x_test, y_test = x, y
+        models, logs = [], []
+        alpha = b = previous_c = gram = None
+        for c in cs:
+            local_kwargs = dict(kwargs, c=c)
+            if alpha is not None:
+                local_kwargs.update(alpha=alpha * (c / previous_c), b=b, gram=gram)
+            self.fit(x, y, **local_kwargs)
+            alpha, b, previous_c, gram = self._alpha, self._b, c, self._gram
+            # fit allocates new arrays, so a shallow copy keeps this solution
+            model = copy(self)
+            model._params = dict(self._params, c=c)
+            model._gram = model._prediction_cache = None
+            models.append(model)
+            logs.append(model.evaluate(x_test, y_test, metrics=list(metrics), tar=None))
+        return models, np.array(logs)
+
 
 class GDSVM(GDKernelBase):
     GDSVMTiming = Timing()
 
     @GDSVMTiming.timeit(level=1, prefix="[Core] ")
     def _get_grads(self, x_batch, y_batch, y_pred, sample_weight_batch, *args):
-        err = -y_batch * (x_batch.dot(self._alpha) + self._b)
+        # y_pred = x_batch.dot(alpha) + b was just computed by _batch_training
+        err = -y_batch * y_pred
         mask = err >= 0
         if np.max(err) < 0:
             self._model_grads = [None, None]
@@ -0,0 +1,58 @@
+import os
+import sys
+root_path = os.path.abspath("../")
+if root_path not in sys.path:
+    sys.path.append(root_path)
+
+import unittest
+import numpy as np
+
+from e_SVM.KP import KP, GDKP
+from e_SVM.SVM import SVM, GDSVM
+
+from Util.Util import DataUtil
+
+np.random.seed(142857)
+x, y = DataUtil.gen_spiral(50, 4, 2, 2, one_hot=False)
+y[y == 0] = -1
+x_test = np.random.uniform(-1, 1, [500, 2])
+
+
+def full_prediction(model, coef):
+    # Predictions of the model before compaction (every training sample)
+    return model["kernel"].dot(x_test, model["x"], coef).ravel() + model["b"]
+
+
+class TestCompact(unittest.TestCase):
+    def _fit(self, model, **kwargs):
+        np.random.seed(0)
+        model.fit(x, y, kernel="rbf", gamma=5., **kwargs)
+        return model
+
+    def test_00_smo(self):
+        for model, kwargs in ((SVM(), {"epoch": 1000}), (KP(), {"epoch": 1000})):
+            model = self._fit(model, **kwargs)
+            self.assertLess(model.n_support, len(x), "{} is not compacted".format(model))
+            self.assertTrue(np.allclose(
+                model.predict(x_test, get_raw_results=True).ravel(), full_prediction(model, model["w"])
+            ), "Compacted {} predicts differently".format(model))
+
+    def test_01_gradient_descent(self):
+        for model in (GDSVM(sv_tol=0.05), GDKP(sv_tol=0.05)):
+            model = self._fit(model, epoch=300)
+            alpha = model["alpha"]
+            dropped = np.abs(alpha) <= 0.05 * np.abs(alpha).max()
+            self.assertGreater(dropped.sum(), 0, "{} is not compacted".format(model))
+            self.assertEqual(model.n_support, len(x) - dropped.sum())
+            # rbf kernels are bounded by 1, so predictions move by at most the dropped alphas
+            self.assertLessEqual(np.abs(
+                model.predict(x_test, get_raw_results=True).ravel() - full_prediction(model, alpha)
+            ).max(), np.abs(alpha[dropped]).sum() + 1e-4, "Compacted {} predicts differently".format(model))
+
+    def test_02_no_compaction(self):
+        model = self._fit(GDSVM(sv_tol=0), epoch=30)
+        self.assertEqual(model.n_support, len(x), "Samples are dropped with sv_tol=0")
+
+
+if __name__ == '__main__':
+    unittest.main()